@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# Hardware-free benchmarks of the gait, IK and image hot paths.
+#
+#   python benchmark.py                 run everything and compare with benchmark_baseline.json
+#   python benchmark.py --save          run and store the results as the new baseline
+#   python benchmark.py -k ik --check   run matching benchmarks, exit 1 on a regression
+#
+# Every benchmark is timed in `--repeat` runs in each of `--processes` fresh interpreters (speed
+# also varies from process to process) and the median of all runs is compared, so one slow run
+# or process is not a regression. A drop only counts once it exceeds both the tolerance and the
+# spread between runs seen now and when the baseline was saved. Peak allocations are compared as well.
+# Baselines are only comparable on the same machine, so they are stored per host and the file
+# is not checked in; run with --save once on each machine (e.g. the Pi itself).
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from dog import *
+from controller import *
+from setting_reader import read_settings
+from trajectory_planning import *
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.25  # report a regression when ops/sec drops by more than 25 %
+DEFAULT_REPEAT = 3
+DEFAULT_PROCESSES = 3
+ALLOC_TOLERANCE = 0.25  # ... or when peak allocation per op grows by more than 25 %
+ALLOC_SLACK = 64  # and by more than this many bytes per op
+
+
+class DummyChannel:
+	def __init__(self):
+		self.duty_cycle = 0
+
+
+class DummyPca:
+	def __init__(self):
+		self.channels = [DummyChannel() for _ in range(16)]
+
+
+def make_legs():
+	settings, default, front_left, front_right, rear_left, rear_right, general, head = read_settings("settings.json")
+	pca = DummyPca()
+	return [Leg(pca, default, leg_settings) for leg_settings in (front_left, front_right, rear_left, rear_right)]
+
+
+def reachable_targets(leg, count=20):
+	# Grid of foot positions well inside the workspace of `leg`
+	targets = []
+	reach = leg.thigh_len + leg.shank_len
+	for i in range(count):
+		for j in range(count):
+			x = -0.3 * reach + 0.6 * reach * i / (count - 1)
+			y = -0.3 * reach + 0.6 * reach * j / (count - 1)
+			targets.append((x, y, -0.75 * reach))
+	return targets
+
+
+# Each benchmark returns (function, operations per call of function)
+def bench_controller_step():
+	controller = Controller()
+	controller.set_speeds(20, 0, 0, 3)
+
+	def run():
+		controller.next_point()
+		controller.get_positions()
+	return run, 1
+
+
+def bench_go_to_position():
+	leg = make_legs()[0]
+	targets = reachable_targets(leg)
+
+	def run():
+		for target in targets:
+			leg.go_to_position(*target)
+	return run, len(targets)
+
+
+def bench_ik_batch():
+	legs = make_legs()
+	targets = np.array(reachable_targets(legs[0]))
+
+	def run():
+		legs[0].solve_positions(targets)
+	return run, len(targets)
+
+
+def bench_angle_to_pulse():
+	angles = [-100 + i * 0.5 for i in range(400)]
+
+	def run():
+		for angle in angles:
+			angle_to_pulse(angle, -90, 90)
+	return run, len(angles)
+
+
+def bench_pulse_table():
+	table = pulse_table(-90, 90)
+	angles = [-100 + i * 0.5 for i in range(400)]
+
+	def run():
+		for angle in angles:
+			table.lookup(angle)
+	return run, len(angles)
+
+
+def bench_pulse_table_array():
+	table = pulse_table(-90, 90)
+	angles = np.array([-100 + i * 0.5 for i in range(400)])
+
+	def run():
+		table.lookup_array(angles)
+	return run, len(angles)
+
+
+def bench_interpolate_path():
+	reference_points = [
+		[0, 0, 0, 0],
+		[1, 1, -0.5, 30],
+		[1, 1, -1, 60],
+		[0, 0, -1, 200],
+		[-1, -1, -1, 60],
+		[-1, -1, -0.5, 30],
+		[0, 0, -0, 0]
+	]
+
+	def run():
+		interpolate_path(reference_points, 2)
+	return run, 1
+
+
+def bench_spline_cycle():
+	trajectory = GaitTrajectory()
+
+	def run():
+		trajectory.cycle(200)
+	return run, 1
+
+
+def bench_gait_table():
+	legs = make_legs()
+	controller = Controller()
+	controller.set_speeds(20, 0, 0, 3)
+
+	def run():
+		solve_legs_batch(legs, controller.positions_table())
+	return run, 1
+
+
+def bench_process_image():
+	import cv2
+	from camera import SyntheticCamera, process_image
+	camera = SyntheticCamera(640, 480)
+	frames = [cv2.imencode(".jpg", camera.render(i))[1].tobytes() for i in range(4)]
+
+	def run():
+		for frame in frames:
+			process_image(frame, flip=True)
+	return run, len(frames)
+
+
+BENCHMARKS = {
+	"controller.step": bench_controller_step,
+	"leg.go_to_position": bench_go_to_position,
+	"ik.batch": bench_ik_batch,
+	"angle_to_pulse": bench_angle_to_pulse,
+	"pulse_table.lookup": bench_pulse_table,
+	"pulse_table.array": bench_pulse_table_array,
+	"interpolate_path": bench_interpolate_path,
+	"trajectory.spline_cycle": bench_spline_cycle,
+	"gait.table": bench_gait_table,
+	"camera.process_image": bench_process_image,
+}
+
+
+def timed_run(run, ops_per_call, min_time):
+	# ops/sec of one run of at least min_time seconds
+	calls = 0
+	start = time.perf_counter()
+	elapsed = 0.0
+	while elapsed < min_time:
+		run()
+		calls += 1
+		elapsed = time.perf_counter() - start
+	return calls * ops_per_call / elapsed
+
+
+def allocations(run, ops_per_call, passes=3):
+	# Separate passes because tracemalloc slows everything down. The smallest peak counts: a
+	# pass can be charged for one-off allocations (free lists, caches) that are not per op.
+	peaks = []
+	retained = []
+	for _ in range(passes):
+		tracemalloc.start()
+		tracemalloc.reset_peak()
+		base, _ = tracemalloc.get_traced_memory()
+		run()
+		current, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		peaks.append((peak - base) / ops_per_call)
+		retained.append(current - base)
+	return min(peaks), min(retained)
+
+
+def measure(factories, min_time, repeat=DEFAULT_REPEAT):
+	# factories: {name: benchmark}. ops/sec is the median of `repeat` runs of at least min_time
+	# seconds each. The runs go round robin over all benchmarks, so a slow spell of the machine
+	# costs every benchmark one run instead of skewing the median of a few.
+	runs = {}
+	for name, factory in factories.items():
+		try:
+			run, ops_per_call = factory()
+		except ImportError as e:
+			print(f"{name:26} skipped ({e})", file=sys.stderr)
+			continue
+		run()  # warm up
+		runs[name] = (run, ops_per_call)
+	rates = {name: [] for name in runs}
+	for _ in range(repeat):
+		for name, (run, ops_per_call) in runs.items():
+			rates[name].append(timed_run(run, ops_per_call, min_time))
+	results = {}
+	for name, (run, ops_per_call) in runs.items():
+		peak, retained = allocations(run, ops_per_call)
+		results[name] = {
+			"ops_per_sec": float(np.median(rates[name])),
+			"peak_alloc_bytes_per_op": peak,
+			"retained_bytes": retained,
+			"runs": rates[name],
+		}
+	return results
+
+
+def spread(runs):
+	# Relative spread between the fastest and the slowest run
+	return float((max(runs) - min(runs)) / np.median(runs))
+
+
+def host_key():
+	return f"{platform.node()} / {platform.machine()} / Python {platform.python_version()}"
+
+
+def measure_in_processes(args):
+	# measure() in args.processes fresh interpreters; the median is taken over all their runs,
+	# the smallest peak allocation over all processes
+	command = [sys.executable, __file__, "--worker", "-k", args.pattern, "--time", str(args.time),
+			   "--repeat", str(args.repeat)]
+	results = {}
+	for _ in range(args.processes):
+		output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+		for name, result in json.loads(output.splitlines()[-1]).items():
+			if name in results:
+				results[name]["runs"] += result["runs"]
+				for key in ("peak_alloc_bytes_per_op", "retained_bytes"):
+					results[name][key] = min(results[name][key], result[key])
+			else:
+				results[name] = result
+	for result in results.values():
+		result["ops_per_sec"] = float(np.median(result["runs"]))
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Hardware-free hot path benchmarks")
+	parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks whose name contains this")
+	parser.add_argument("--time", type=float, default=0.3, help="seconds per run")
+	parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per benchmark and process")
+	parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="fresh interpreters to run in")
+	parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+	parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+	parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+	parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+	parser.add_argument("--baseline", default=BASELINE_FILE)
+	args = parser.parse_args()
+	if args.worker:
+		print(json.dumps(measure({name: factory for name, factory in BENCHMARKS.items() if args.pattern in name},
+								 args.time, args.repeat)))
+		return
+
+	try:
+		with open(args.baseline) as f:
+			baselines = json.load(f)
+	except (OSError, ValueError):
+		baselines = {}
+	host = host_key()
+	baseline = baselines.setdefault(host, {"results": {}})
+	if not baseline["results"]:
+		print(f"No baseline for {host} in {args.baseline}; run with --save to record one")
+
+	regressions = []
+	print(f"{'benchmark':26} {'ops/sec':>12} {'baseline':>12} {'change':>8} {'peak B/op':>10} {'baseline':>10}")
+	results = measure_in_processes(args)
+	for name, result in results.items():
+		reference = baseline["results"].get(name)
+		change = ""
+		alloc_change = ""
+		if reference:
+			ratio = result["ops_per_sec"] / reference["ops_per_sec"]
+			change = f"{(ratio - 1) * 100:+.1f}%"
+			tolerance = max(args.tolerance, spread(result["runs"]), reference.get("spread", 0.0))
+			if ratio < 1 - tolerance:
+				regressions.append(name)
+				change += " !"
+			peak, reference_peak = result["peak_alloc_bytes_per_op"], reference["peak_alloc_bytes_per_op"]
+			if peak > reference_peak * (1 + ALLOC_TOLERANCE) and peak - reference_peak > ALLOC_SLACK:
+				regressions.append(f"{name} (allocation)")
+				alloc_change = " !"
+		print(f"{name:26} {result['ops_per_sec']:12.1f} "
+			  f"{reference['ops_per_sec'] if reference else float('nan'):12.1f} {change:>8} "
+			  f"{result['peak_alloc_bytes_per_op']:10.0f} "
+			  f"{reference['peak_alloc_bytes_per_op'] if reference else float('nan'):10.0f}{alloc_change}")
+
+	if args.save:
+		baseline["results"].update({name: {**{key: value for key, value in result.items() if key != "runs"},
+										   "spread": spread(result["runs"])}
+									for name, result in results.items()})
+		with open(args.baseline, "w") as f:
+			json.dump(baselines, f, indent=2, sort_keys=True)
+		print(f"Saved baseline for {host} to {args.baseline}")
+	if regressions:
+		print("Regressions:", ", ".join(regressions))
+		if args.check:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
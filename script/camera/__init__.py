@@ -1,2 +1,4 @@
 from .image_analysis import *
+from .sources import *
 
+from .lores_analysis import *
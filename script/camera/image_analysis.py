@@ -1,13 +1,30 @@
 #!/usr/bin/env python3
+import time
+
 import cv2
 import numpy as np
 
-def process_image(frame_bytes):
+from profiler import PROFILER
+
+_decode_stage = PROFILER.stage("camera.decode")
+_flip_stage = PROFILER.stage("camera.flip")
+_encode_stage = PROFILER.stage("camera.encode")
+
+# Optional analysis stage; orientation is normally fixed on the sensor (camera.vflip),
+# so the software flip is only for sources that cannot flip themselves
+def process_image(frame_bytes, flip=False):
+	start = time.perf_counter()
 	arr = np.frombuffer(frame_bytes, dtype=np.uint8)
 	frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-	frame = cv2.flip(frame, 0)
+	_decode_stage.record_since(start)
 	# frame = cv2.resiz1e(frame, (640, 480))
 	if frame is None:
 		return frame_bytes
+	if flip:
+		start = time.perf_counter()
+		frame = cv2.flip(frame, 0)
+		_flip_stage.record_since(start)
+	start = time.perf_counter()
 	_, new_jpeg = cv2.imencode(".jpg", frame)
-	return new_jpeg.tobytes()
+	_encode_stage.record_since(start)
+	return new_jpeg  # any buffer will do, FrameRing.write copies it without tobytes()
@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from profiler import PROFILER
+from scheduler import RateScheduler
+
+_lores_stage = PROFILER.stage("camera.lores")
+
+
+class LoresAnalyzer:
+	# Motion and brightness centroids of the luma (Y) plane of the lores stream.
+	# Works on the camera buffer in place, no JPEG decode; every intermediate image is
+	# preallocated, so an analysis only allocates the small result dict.
+	# Coordinates are fractions of the frame size, (0, 0) is the top left corner.
+	def __init__(self, width, height, motion_threshold=25):
+		self.width = width
+		self.height = height
+		self.motion_threshold = motion_threshold
+		self.previous = np.zeros((height, width), dtype=np.uint8)
+		self.difference = np.empty((height, width), dtype=np.uint8)
+		self.mask = np.empty((height, width), dtype=np.uint8)
+		self.frames = 0
+
+	def centroid(self, moments):
+		if not moments["m00"]:
+			return None
+		return [moments["m10"] / moments["m00"] / self.width, moments["m01"] / moments["m00"] / self.height]
+
+	def analyse(self, y_plane):
+		brightness = cv2.moments(y_plane)
+		result = {
+			"type": "vision",
+			"frame": self.frames,
+			"brightness": brightness["m00"] / (255.0 * self.width * self.height),
+			"centroid": self.centroid(brightness),
+			"motion": None,
+			"motion_centroid": None,
+		}
+		if self.frames:
+			cv2.absdiff(y_plane, self.previous, dst=self.difference)
+			cv2.threshold(self.difference, self.motion_threshold, 255, cv2.THRESH_BINARY, dst=self.mask)
+			motion = cv2.moments(self.mask, binaryImage=True)
+			result["motion"] = motion["m00"] / (self.width * self.height)
+			result["motion_centroid"] = self.centroid(motion)
+		np.copyto(self.previous, y_plane)
+		self.frames += 1
+		return result
+
+
+class LoresAnalysis(threading.Thread):
+	# Runs a LoresAnalyzer on the camera's lores stream at `rate` Hz, independent of the
+	# MJPEG frame rate, and hands every result to on_result (e.g. a WebSocket broadcast)
+	def __init__(self, source, analyzer, rate=5, on_result=None):
+		super().__init__(daemon=True)
+		self.source = source
+		self.analyzer = analyzer
+		self.scheduler = RateScheduler(rate)
+		self.on_result = on_result
+		self.running = True
+
+	def run(self):
+		while self.running:
+			self.scheduler.wait()
+			start = time.perf_counter()
+			try:
+				result = self.source.read_lores(self.analyzer.analyse)
+			except Exception as e:
+				logging.warning(f"Lores analysis failed: {e}")
+				continue
+			_lores_stage.record_since(start)
+			if self.on_result is not None:
+				self.on_result(result)
+
+	def stop(self):
+		self.running = False
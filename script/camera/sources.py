@@ -0,0 +1,155 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class PiCameraSource:
+	# Picamera2 video stream encoded to MJPEG by the ISP-side JpegEncoder.
+	# The image is flipped by the sensor readout, so encoder output needs no post-processing.
+	# lores: optional (width, height) of a second, YUV420 stream scaled by the ISP for analysis
+	# quality, frame rate and resolution can be changed while recording (see StreamAdapter)
+	supports_h264 = True  # start_h264 is available
+
+	def __init__(self, width, height, vflip=True, lores=None, quality=85, fps=30):
+		from picamera2 import Picamera2
+		self.picam2 = Picamera2()
+		self.size = (width, height)
+		self.vflip = vflip
+		self.lores = lores
+		self.quality = quality
+		self.fps = fps
+		self.encoder = None
+		self.output = None
+		self.configure()
+
+	def configure(self):
+		from libcamera import Transform
+		streams = {"main": {"size": self.size}}
+		if self.lores is not None:
+			streams["lores"] = {"size": self.lores, "format": "YUV420"}
+		self.picam2.configure(self.picam2.create_video_configuration(
+			**streams, transform=Transform(vflip=self.vflip), controls={"FrameDurationLimits": self.frame_duration()}))
+
+	def frame_duration(self):
+		duration = int(1_000_000 / self.fps)
+		return (duration, duration)
+
+	def start(self, output):
+		from picamera2.encoders import JpegEncoder
+		from picamera2.outputs import FileOutput
+		self.output = output
+		self.encoder = JpegEncoder(q=self.quality)
+		self.picam2.start_recording(self.encoder, FileOutput(output))
+
+	def start_h264(self, output, bitrate, iperiod):
+		# Hardware H.264 instead of MJPEG; output gets one Annex-B access unit per write().
+		# SPS/PPS are repeated on every keyframe (each iperiod frames) so viewers can join at any time.
+		from picamera2.encoders import H264Encoder
+		from picamera2.outputs import FileOutput
+		self.output = output
+		self.encoder = H264Encoder(bitrate=bitrate, repeat=True, iperiod=iperiod)
+		self.picam2.start_recording(self.encoder, FileOutput(output))
+
+	def set_quality(self, quality):
+		# Read by the encoder for every frame
+		self.quality = quality
+		if self.encoder is not None:
+			self.encoder.q = quality
+
+	def set_frame_rate(self, fps):
+		if fps != self.fps:
+			self.fps = fps
+			self.picam2.set_controls({"FrameDurationLimits": self.frame_duration()})
+
+	def set_resolution(self, size):
+		# Needs a stop and reconfigure of the camera, the stream pauses for a moment
+		from picamera2.outputs import FileOutput
+		if tuple(size) == self.size:
+			return
+		self.size = tuple(size)
+		self.picam2.stop_recording()
+		self.configure()
+		self.picam2.start_recording(self.encoder, FileOutput(self.output))
+
+	def read_lores(self, consumer):
+		# Calls consumer with the Y plane of the next lores frame, mapped straight from the
+		# camera buffer; the view is only valid inside consumer
+		from picamera2 import MappedArray
+		request = self.picam2.capture_request()
+		try:
+			with MappedArray(request, "lores") as mapped:
+				width, height = self.lores
+				return consumer(mapped.array[:height, :width])
+		finally:
+			request.release()
+
+	def stop(self):
+		self.picam2.stop_recording()
+
+
+class SyntheticCamera:
+	# Hardware-free frame source: renders a moving test pattern, JPEG encodes it and
+	# writes it to the output at a fixed frame rate, like Picamera2's FileOutput does.
+	# It has no physical mounting, so the pattern is always rendered upright (no vflip).
+	supports_h264 = False  # H.264 needs the Pi's hardware encoder
+
+	def __init__(self, width, height, fps=30, lores=None, quality=85):
+		self.width = width
+		self.height = height
+		self.quality = quality
+		self.period = 1.0 / fps
+		self.frames = 0
+		self.running = False
+		self.thread = None
+		self.lores = lores
+		self.background = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+
+	def render(self, index):
+		frame = cv2.cvtColor(self.background, cv2.COLOR_GRAY2BGR)
+		x = (index * 8) % self.width
+		cv2.rectangle(frame, (x, self.height // 3), (x + 40, self.height // 3 + 40), (0, 0, 255), -1)
+		cv2.putText(frame, str(index), (10, self.height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+		return frame
+
+	def start(self, output):
+		self.running = True
+		self.thread = threading.Thread(target=self._run, args=(output,), daemon=True)
+		self.thread.start()
+
+	def _run(self, output):
+		deadline = time.monotonic()
+		while self.running:
+			_, jpeg = cv2.imencode(".jpg", self.render(self.frames), [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+			output.write(jpeg.tobytes())
+			self.frames += 1
+			deadline += self.period
+			time.sleep(max(0.0, deadline - time.monotonic()))
+
+	def set_quality(self, quality):
+		self.quality = quality
+
+	def set_frame_rate(self, fps):
+		self.period = 1.0 / fps
+
+	def set_resolution(self, size):
+		width, height = size
+		background = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+		self.width, self.height, self.background = width, height, background
+
+	def read_lores(self, consumer):
+		# Same contract as PiCameraSource.read_lores, rendered and scaled in software
+		frame = cv2.cvtColor(self.render(self.frames), cv2.COLOR_BGR2GRAY)
+		return consumer(cv2.resize(frame, self.lores, interpolation=cv2.INTER_AREA))
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+
+
+def open_camera(backend, width, height, vflip=True, lores=None):
+	if backend == "sim":
+		return SyntheticCamera(width, height, lores=lores)
+	return PiCameraSource(width, height, vflip=vflip, lores=lores)
@@ -0,0 +1,72 @@
+import time
+from array import array
+
+from joystick_protocol import AXES
+
+# Axis indices into ControlInput / ControlSnapshot.axes, same order as joystick_protocol.AXES
+JOY1_X, JOY1_Y, JOY2_X, JOY2_Y, JOY3_X, JOY3_Y, KEYBOARD_X, KEYBOARD_Y = range(len(AXES))
+
+_HEADER = 8  # int64 generation counter
+SIZE = _HEADER + 8 * len(AXES)
+
+
+class ControlInput:
+	# Joystick axes shared between one writer (the WebSocket loop) and any number of readers.
+	# Seqlock: the writer makes the generation odd, stores the axes and makes it even again;
+	# readers copy the axes and retry if the generation was odd or moved meanwhile. Neither
+	# side takes a lock, so the event loop is never blocked by the control thread.
+	# buffer may be any writable buffer of at least SIZE bytes, e.g. shared memory.
+	def __init__(self, buffer=None):
+		self.buffer = buffer if buffer is not None else bytearray(SIZE)
+		self.view = memoryview(self.buffer)
+		self.generation = self.view[:_HEADER].cast('q')
+		self.axes = self.view[_HEADER:SIZE].cast('d')
+
+	def release(self):
+		# Drop the views so that a shared memory block can be closed
+		self.generation.release()
+		self.axes.release()
+		self.view.release()
+		if isinstance(self.buffer, memoryview):
+			self.buffer.release()
+
+	def write(self, values):
+		generation = self.generation[0]
+		self.generation[0] = generation + 1
+		axes = self.axes
+		for i, value in enumerate(values):
+			axes[i] = value
+		self.generation[0] = generation + 2
+
+	def write_state(self, state):
+		# state is the JSON message layout: {"joy1": {"x": .., "y": ..}, ...}
+		self.write([float(state.get(name, {}).get(axis, 0) or 0) for name, axis in AXES])
+
+	def reader(self):
+		return ControlSnapshot(self)
+
+
+class ControlSnapshot:
+	# Preallocated consistent copy of a ControlInput; refresh() does not allocate
+	__slots__ = ("source", "axes", "view", "generation")
+
+	def __init__(self, source):
+		self.source = source
+		self.axes = array('d', bytes(8 * len(AXES)))
+		self.view = memoryview(self.axes)
+		self.generation = -1
+
+	def refresh(self):
+		# Returns True if the axes changed since the previous refresh
+		source_generation = self.source.generation
+		while True:
+			generation = source_generation[0]
+			if generation & 1:
+				time.sleep(0)  # writer is mid-update; let it finish
+				continue
+			if generation == self.generation:
+				return False
+			self.view[:] = self.source.axes
+			if source_generation[0] == generation:
+				self.generation = generation
+				return True
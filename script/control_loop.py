@@ -0,0 +1,193 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing import shared_memory
+
+import overal_controller
+from scheduler import RateScheduler
+from profiler import PROFILER
+from control_input import *
+from flight_recorder import FlightRecorder
+
+SETTINGS_POLL_INTERVAL = 1.0  # seconds between settings.json mtime checks
+
+# Control loop counters shared with the parent process, float64 each
+STATS_FIELDS = ("rate", "ticks", "overruns", "skipped", "gait_hits", "gait_misses", "ik_clamped", "ik_saturated",
+				"tick_p50_ms", "tick_p99_ms", "tick_max_ms")
+# Profiler stages recorded in the control process, followed by their summaries
+CONTROL_STAGES = ("control.tick", "control.joystick", "control.gait", "control.head", "control.planner", "control.i2c",
+				  "gait.compile")
+STAGE_FIELDS = ("count", "mean_ms", "p50_ms", "p99_ms", "window_max_ms", "max_ms", "budget_ms", "overruns")
+STATS_SIZE = 8 * (len(STATS_FIELDS) + len(CONTROL_STAGES) * len(STAGE_FIELDS))
+
+
+class ControlLoop:
+	# The gait/servo loop: reads the joystick snapshot, runs the gait and head and commits the
+	# servo frame once per scheduler tick. Used by the in-process thread and by ControlProcess.
+	def __init__(self, control_input, backend=None, stats_buffer=None):
+		self.Controller = overal_controller.OveralController(backend)
+		self.scheduler = RateScheduler(self.Controller.control_rate)
+		self.joystick = control_input.reader()
+		self.settings_poll_ticks = max(1, int(SETTINGS_POLL_INTERVAL * self.Controller.control_rate))
+		self.shared_stats = memoryview(stats_buffer).cast('d') if stats_buffer is not None else None
+		self.tick_stage = PROFILER.stage("control.tick", budget=self.scheduler.period)
+		self.joystick_stage = PROFILER.stage("control.joystick")
+		self.gait_stage = PROFILER.stage("control.gait")
+		self.head_stage = PROFILER.stage("control.head")
+		# Always-on record of every tick, see flight_recorder.py and replay.py
+		general = self.Controller.settings_watcher.settings["general"]
+		path = general.get("flight_recorder")
+		self.recorder = FlightRecorder(path, general.get("flight_recorder_ticks", 30000)) if path else None
+		self.running = True
+
+	def run(self):
+		try:
+			while self.running:
+				self.scheduler.wait()
+				self.tick()
+		finally:
+			self.close()
+
+	def stop(self):
+		# Thread-safe; run() returns after the current tick
+		self.running = False
+
+	def close(self):
+		# Writes the flight recording's header and flushes it to disk
+		if self.recorder is not None:
+			self.recorder.close()
+			self.recorder = None
+
+	def tick(self):
+		js = self.joystick.axes
+		now = time.monotonic()
+		tick_start = time.perf_counter()
+		if self.scheduler.ticks % self.settings_poll_ticks == 0:
+			updated = self.Controller.reload_settings()
+			if updated:
+				print(f"[Settings] Reloaded calibration for {', '.join(updated)}")
+			if self.shared_stats is not None:
+				self.publish_stats()
+		start = time.perf_counter()
+		self.joystick.refresh()
+		self.joystick_stage.record_since(start)
+		start = time.perf_counter()
+		if (-js[JOY1_Y] or js[JOY1_X] or js[JOY2_X]):
+			self.Controller.iterate(-js[JOY1_Y], js[JOY1_X], js[JOY2_X], self.scheduler.dt, now)
+			self.gait_stage.record_since(start)
+		start = time.perf_counter()
+		self.Controller.head.move(js[JOY3_X], js[JOY3_Y], self.scheduler.dt)
+		self.head_stage.record_since(start)
+		start = time.perf_counter()
+		self.Controller.commit(self.scheduler.dt)
+		if self.recorder is not None:
+			self.recorder.record(self.scheduler.ticks, now, self.scheduler.dt, time.perf_counter() - start, js, self.Controller)
+		self.tick_stage.record_since(tick_start)
+
+	def stats(self):
+		tick = self.tick_stage.summary()
+		return {
+			**self.scheduler.stats(),
+			"gait_hits": self.Controller.gait_cache.hits,
+			"gait_misses": self.Controller.gait_cache.misses,
+			# Gait frames with an unreachable foot target, joint positions held at a limit
+			"ik_clamped": int(self.Controller.ik_clamped.sum()),
+			"ik_saturated": int(self.Controller.ik_saturated.sum()),
+			"tick_p50_ms": tick.get("p50_ms", 0.0),
+			"tick_p99_ms": tick.get("p99_ms", 0.0),
+			"tick_max_ms": tick.get("max_ms", 0.0),
+		}
+
+	def publish_stats(self):
+		stats = self.stats()
+		for i, name in enumerate(STATS_FIELDS):
+			self.shared_stats[i] = stats[name]
+		# Stages that were never recorded publish count 0; a missing budget is NaN
+		i = len(STATS_FIELDS)
+		for stage in CONTROL_STAGES:
+			summary = PROFILER.stage(stage).summary()
+			for name in STAGE_FIELDS:
+				value = summary.get(name, 0.0)
+				self.shared_stats[i] = value if value is not None else float("nan")
+				i += 1
+
+
+def pin_to_cpus(cpus):
+	# Best effort: CPU affinity is Linux only
+	if cpus and hasattr(os, "sched_setaffinity"):
+		try:
+			os.sched_setaffinity(0, cpus)
+		except OSError as e:
+			logging.warning(f"Cannot pin to CPUs {cpus}: {e}")
+
+
+def run_control_process(shm_name, backend, cpus):
+	pin_to_cpus(cpus)
+	shm = shared_memory.SharedMemory(name=shm_name)
+	control_input = ControlInput(shm.buf[:SIZE])
+	stats_buffer = shm.buf[SIZE:SIZE + STATS_SIZE]
+	loop = ControlLoop(control_input, backend, stats_buffer)
+	# Ctrl-C reaches the whole process group; the parent stops this process with
+	# ControlProcess.close(), whose SIGTERM lets the tick finish and the recorder close first
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, lambda signum, frame: loop.stop())
+	try:
+		loop.run()
+	finally:
+		loop.shared_stats.release()
+		stats_buffer.release()
+		control_input.release()
+		shm.close()
+
+
+class ControlProcess:
+	# Runs ControlLoop in a child process pinned to `cpu`, so servo timing does not share the GIL
+	# with the camera, HTTP and WebSocket threads. Joystick axes (a seqlocked ControlInput) and
+	# the loop counters live in one shared memory block; nothing is pickled per tick.
+	# Uses fork, so it must be started before the parent starts its own threads.
+	def __init__(self, backend=None, cpu=None):
+		self.shm = shared_memory.SharedMemory(create=True, size=SIZE + STATS_SIZE)
+		self.shm.buf[:SIZE + STATS_SIZE] = bytes(SIZE + STATS_SIZE)
+		self.control_input = ControlInput(self.shm.buf[:SIZE])
+		self.shared_stats = self.shm.buf[SIZE:SIZE + STATS_SIZE].cast('d')
+		cpus = {cpu} if cpu is not None else None
+		self.process = multiprocessing.get_context("fork").Process(
+			target=run_control_process, args=(self.shm.name, backend, cpus), daemon=True)
+
+	def start(self):
+		self.process.start()
+
+	def stats(self):
+		stats = {name: self.shared_stats[i] for i, name in enumerate(STATS_FIELDS)}
+		stats["alive"] = self.process.is_alive()
+		return stats
+
+	def stage_stats(self):
+		# The child's profiler summaries in PROFILER.snapshot() form, as of its last publish
+		stages = {}
+		i = len(STATS_FIELDS)
+		for stage in CONTROL_STAGES:
+			summary = {name: self.shared_stats[i + j] for j, name in enumerate(STAGE_FIELDS)}
+			i += len(STAGE_FIELDS)
+			if summary["count"] == 0:
+				stages[stage] = {"count": 0}
+				continue
+			summary["count"] = int(summary["count"])
+			summary["overruns"] = int(summary["overruns"])
+			if summary["budget_ms"] != summary["budget_ms"]:
+				summary["budget_ms"] = None
+			stages[stage] = summary
+		return stages
+
+	def close(self):
+		self.process.terminate()
+		self.process.join(2.0)
+		if self.process.is_alive():
+			self.process.kill()
+			self.process.join()
+		self.shared_stats.release()
+		self.control_input.release()
+		self.shm.close()
+		self.shm.unlink()
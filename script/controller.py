@@ -1,8 +1,43 @@
+from collections import OrderedDict
+
+import numpy as np
+
 from trajectory_planning import *
 
+LEG_NAMES = ('front_left', 'front_right', 'rear_left', 'rear_right')
+
+
+class GaitCache:
+	# Small LRU of compiled gait tables keyed by Controller.gait_key()
+	def __init__(self, capacity=16):
+		self.capacity = capacity
+		self.tables = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		table = self.tables.get(key)
+		if table is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.tables.move_to_end(key)
+		return table
+
+	def put(self, key, table):
+		self.tables[key] = table
+		self.tables.move_to_end(key)
+		while len(self.tables) > self.capacity:
+			self.tables.popitem(last=False)
+
+	def clear(self):
+		self.tables.clear()
+
 
 class Controller:
-	def __init__(self):
+	# trajectory: optional GaitTrajectory sampled at `points` instants instead of the
+	# interpolated reference path. advance(dt) then moves the phase in real time.
+	def __init__(self, trajectory=None, points=200):
 		reference_points = [
 			[0, 0, 0, 0],
 			[1, 1, -0.5, 30],
@@ -14,8 +49,13 @@ class Controller:
 			[0, 0, -0, 0]
 		]
 
-		self.path = interpolate_path(reference_points, 2)
+		if trajectory is None:
+			self.path = interpolate_path(reference_points, 2)
+		else:
+			self.path = trajectory.cycle(points)
 		self.path_len = len(self.path)
+		self.phase = 0.0
+		self.frequency = 1.0  # gait cycles per second, used by advance()
 		self.front_left_pos = 0
 		self.front_right_pos = self.path_len // 4
 		self.rear_left_pos = self.path_len // 2
@@ -77,12 +117,53 @@ class Controller:
 			rr = compute_leg('rear_right',  self.path[self.rear_right_pos])
 		return [fl, fr, rl, rr]
 
+	def advance(self, dt):
+		# Move every leg by the same number of path points so that the cycle runs at
+		# self.frequency in real time, independent of tick rate and path density
+		self.phase = (self.phase + self.frequency * dt) % 1.0
+		index = int(self.phase * self.path_len) % self.path_len
+		delta = index - self.front_left_pos
+		self.front_left_pos = index
+		self.front_right_pos = (self.front_right_pos + delta) % self.path_len
+		self.rear_left_pos = (self.rear_left_pos + delta) % self.path_len
+		self.rear_right_pos = (self.rear_right_pos + delta) % self.path_len
+
+	def phase_offsets(self):
+		# Path index of every leg relative to the front left leg, in get_positions order
+		if self.trot:
+			positions = [self.front_left_pos, self.rear_left_pos, self.rear_left_pos, self.front_left_pos]
+		else:
+			positions = [self.front_left_pos, self.front_right_pos, self.rear_left_pos, self.rear_right_pos]
+		return [(pos - self.front_left_pos) % self.path_len for pos in positions]
+
+	def gait_key(self):
+		return (self.front_speed, self.right_speed, self.rotation_speed, self.steps,
+				self.height_top, self.height_bottom, self.stabilise_sideways, self.trot)
+
+	def positions_table(self):
+		# Foot targets for every phase at the current speeds, shape (path_len, 4, 3).
+		# Row i equals get_positions() while front_left_pos == i.
+		path = np.asarray(self.path, dtype=np.float64)
+		phases = np.arange(self.path_len)
+		table = np.empty((self.path_len, 4, 3))
+		for leg, (name, offset) in enumerate(zip(LEG_NAMES, self.phase_offsets())):
+			points = path[(phases + offset) % self.path_len]
+			lx, ly, lz = points[:, 0], points[:, 1], points[:, 2]
+			rx, ry = self.leg_base[name]
+			table[:, leg, 0] = lx * self.right_speed + self.rotation_speed * rx * lx + self.stabilise_sideways * ry
+			table[:, leg, 1] = ly * self.front_speed + self.rotation_speed * ry * ly
+			table[:, leg, 2] = lz * (self.height_top - self.height_bottom) + self.height_top
+		return table
+
 	def set_speeds(self, forward, right, rotation, steps=1):
 		self.front_speed = forward
 		self.right_speed = -right
 		self.rotation_speed = rotation
 		self.steps = steps
 
+	def set_frequency(self, frequency):
+		self.frequency = frequency
+
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 import math
+from array import array
+from functools import lru_cache
 
-from numpy.f2py.crackfortran import privatepattern
+import numpy as np
 
 
 def bound(val, lower_limit, upper_limit):
@@ -57,6 +59,250 @@ def angle_to_pulse(angle, min_angle, max_angle):
 	return int(duty_12bit) << 4  # Scale to 16-bit by shifting left 4 bits
 
 
+def angle_to_pulse_array(angles, min_angle, max_angle):
+	# angle_to_pulse over a NumPy array, same operations in the same order
+	normalized = (np.asarray(angles, dtype=np.float64) - min_angle) / (max_angle - min_angle)
+	pulse = np.clip(500 + normalized * (2500 - 500), 500, 2500)
+	duty_12bit = (pulse / (1_000_000 / 50)) * 4096
+	return duty_12bit.astype(np.int64) << 4
+
+
+def pulse_to_angle_array(duties, min_angle, max_angle):
+	# Joint angle a servo actually moves to for 16-bit duty cycles from angle_to_pulse:
+	# undoes the 12-bit truncation and pulse clamping as far as they can be undone
+	pulse = (np.asarray(duties, dtype=np.int64) >> 4) * (1_000_000 / 50) / 4096
+	return min_angle + (pulse - 500) / (2500 - 500) * (max_angle - min_angle)
+
+
+PULSE_TABLE_STEP = 0.01  # degrees per table bucket
+
+
+class PulseTable:
+	# Lookup replacement for angle_to_pulse on one (min_angle, max_angle) range, exact by construction.
+	# Bucket i covers [min_angle + i * step, min_angle + (i + 1) * step). angle_to_pulse is monotonic,
+	# so when it gives the same value one step before and one step after a bucket the whole bucket
+	# maps to that value; otherwise the bucket holds 0 and the exact formula is used. The extra step
+	# on each side absorbs float rounding in the bucket index.
+	def __init__(self, min_angle, max_angle, step=PULSE_TABLE_STEP):
+		self.min_angle = min_angle
+		self.max_angle = max_angle
+		self.step = step
+		self.size = int(math.ceil((max_angle - min_angle) / step)) if max_angle > min_angle else 0
+		# edges[k + 1] is the value at the k-th bucket edge
+		edges = angle_to_pulse_array(min_angle + np.arange(-1, self.size + 2) * step, min_angle, max_angle) \
+			if self.size else np.zeros(3, dtype=np.int64)
+		self.values = array('H', np.where(edges[:self.size] == edges[3:self.size + 3], edges[:self.size], 0)
+							.astype(np.uint16).tobytes())
+		self.np_values = np.frombuffer(self.values, dtype=np.uint16).astype(np.int64)
+
+	def lookup(self, angle):
+		if not self.size:
+			return angle_to_pulse(angle, self.min_angle, self.max_angle)
+		index = int((angle - self.min_angle) / self.step)
+		if index < 0:
+			index = 0
+		elif index >= self.size:
+			index = self.size - 1
+		value = self.values[index]
+		return value if value else angle_to_pulse(angle, self.min_angle, self.max_angle)
+
+	def lookup_array(self, angles):
+		angles = np.asarray(angles, dtype=np.float64)
+		if not self.size:
+			return angle_to_pulse_array(angles, self.min_angle, self.max_angle)
+		index = np.clip(((angles - self.min_angle) / self.step).astype(np.int64), 0, self.size - 1)
+		values = self.np_values[index]
+		missing = values == 0
+		if missing.any():
+			values[missing] = angle_to_pulse_array(angles[missing], self.min_angle, self.max_angle)
+		return values
+
+
+@lru_cache(maxsize=64)
+def pulse_table(min_angle, max_angle):
+	# Joints with identical calibrated limits share one table; a calibration change means new limits
+	return PulseTable(min_angle, max_angle)
+
+
+def clamp_to_reach(dx, dy, dz, distance, min_reach, max_reach):
+	# Moves the hip-to-foot vector (dx, dy, dz) of length `distance` onto the reach shell
+	# [min_reach, max_reach] along its own direction, so the base angle and leg direction are kept.
+	# Works on floats and on numpy arrays; returns the vector, its new length and where it was moved.
+	reach = np.clip(distance, min_reach, max_reach)
+	scale = reach / distance
+	return dx * scale, dy * scale, dz * scale, reach, reach != distance
+
+
+def solve_ik_batch(targets, upper_len, thigh_len, shank_len, base_sign=1, hip_sign=1, knee_sign=1,
+				   limits=None, return_flags=False):
+	# Vectorised version of Leg.go_to_position for an (N, 3) array of foot targets.
+	# Link lengths and signs may be scalars or (N,) arrays, so rows can belong to different legs.
+	# Returns an (N, 3) array of base/hip/knee angles in degrees.
+	# Targets outside the reach shell [|thigh - shank|, thigh + shank] around the hip joint are
+	# moved onto it along the hip-to-foot line, like LegKinematics.solve. limits, (3, 2) or (N, 3, 2)
+	# (min, max) degrees with the joint signs applied, clamps the angles to the joint limits.
+	# With return_flags the (N,) clamped and (N, 3) saturated masks are returned as well.
+	targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+	x = targets[:, 0]
+	y = targets[:, 1]
+	z = targets[:, 2]
+	upper_len = np.asarray(upper_len, dtype=np.float64)
+	thigh_len = np.asarray(thigh_len, dtype=np.float64)
+	shank_len = np.asarray(shank_len, dtype=np.float64)
+
+	radius = np.sqrt(z ** 2 + x ** 2)
+	moving = radius != 0
+	base_angle = np.zeros_like(x)
+	np.arcsin(np.divide(x, radius, out=np.zeros_like(x), where=moving), out=base_angle, where=moving)
+
+	upper_x = upper_len * np.sin(base_angle)
+	upper_z = -upper_len * np.cos(base_angle)
+	bottom_x = upper_x - x
+	bottom_y = 0 - y
+	bottom_z = upper_z - z
+	left_distance = np.sqrt(bottom_x ** 2 + bottom_y ** 2 + bottom_z ** 2)
+
+	norm_top = np.sqrt(upper_x ** 2 + upper_z ** 2)
+	if np.any(norm_top == 0.0) or np.any(left_distance == 0.0):
+		raise ValueError("One of the vectors is zero-length.")
+
+	bottom_x, bottom_y, bottom_z, left_distance, clamped = clamp_to_reach(
+		bottom_x, bottom_y, bottom_z, left_distance, np.abs(thigh_len - shank_len), thigh_len + shank_len)
+
+	knee_angle = -(math.pi - np.arccos(np.clip(
+		(thigh_len ** 2 + shank_len ** 2 - left_distance ** 2) / (2 * thigh_len * shank_len), -1, 1)))
+
+	cos_theta = (upper_x * bottom_x + upper_z * bottom_z) / (norm_top * left_distance)
+	inter_angle = np.copysign(math.pi - np.arccos(np.clip(cos_theta, -1.0, 1.0)), y)
+	hip_angle = -np.arccos(np.clip(
+		(thigh_len ** 2 - shank_len ** 2 + left_distance ** 2) / (2 * thigh_len * left_distance), -1, 1)) + inter_angle
+
+	angles = np.empty_like(targets)
+	angles[:, 0] = np.degrees(base_angle) * base_sign
+	angles[:, 1] = np.degrees(hip_angle) * hip_sign
+	angles[:, 2] = np.degrees(knee_angle) * knee_sign
+	saturated = np.zeros(angles.shape, dtype=bool)
+	if limits is not None:
+		limits = np.asarray(limits, dtype=np.float64)
+		saturated = (angles < limits[..., 0]) | (angles > limits[..., 1])
+		np.clip(angles, limits[..., 0], limits[..., 1], out=angles)
+	if return_flags:
+		return angles, clamped, saturated
+	return angles
+
+
+def forward_kinematics_batch(angles, upper_len, thigh_len, shank_len, base_sign=1, hip_sign=1, knee_sign=1):
+	# Foot positions for an (N, 3) array of base/hip/knee angles in degrees (joint signs applied,
+	# as returned by solve_ik_batch). Inverse of solve_ik_batch for feet below the base joint.
+	# The base joint turns the leg plane about y; in that plane the thigh points at the hip angle
+	# from the base-to-hip direction towards +y and the shank is turned back by the knee angle.
+	angles = np.radians(np.asarray(angles, dtype=np.float64).reshape(-1, 3))
+	base = angles[:, 0] * base_sign
+	hip = angles[:, 1] * hip_sign
+	knee = angles[:, 2] * knee_sign
+	along = upper_len + thigh_len * np.cos(hip) + shank_len * np.cos(hip - knee)
+	feet = np.empty_like(angles)
+	feet[:, 0] = along * np.sin(base)
+	feet[:, 1] = thigh_len * np.sin(hip) + shank_len * np.sin(hip - knee)
+	feet[:, 2] = -along * np.cos(base)
+	return feet
+
+
+def solve_legs_batch(legs, targets, return_flags=False):
+	# Solve IK for several legs at once. targets has shape (T, len(legs), 3) or (len(legs), 3);
+	# the result has the same leading shape with base/hip/knee angles in the last axis, clamped
+	# to each leg's joint limits. return_flags adds the clamped (..., legs) and saturated
+	# (..., legs, 3) masks of solve_ik_batch in the same shape.
+	targets = np.asarray(targets, dtype=np.float64)
+	shape = targets.shape
+	count = len(legs)
+	rows = targets.size // (3 * count)
+
+	def per_row(values):
+		return np.tile(np.asarray(values, dtype=np.float64), rows)
+
+	angles, clamped, saturated = solve_ik_batch(
+		targets.reshape(-1, 3),
+		per_row([leg.upper_len for leg in legs]),
+		per_row([leg.thigh_len for leg in legs]),
+		per_row([leg.shank_len for leg in legs]),
+		per_row([leg.private_settings.get("base") for leg in legs]),
+		per_row([leg.private_settings.get("hip") for leg in legs]),
+		per_row([leg.private_settings.get("knee") for leg in legs]),
+		np.tile(np.asarray([leg.kinematics.limits for leg in legs], dtype=np.float64), (rows, 1, 1)),
+		return_flags=True,
+	)
+	if return_flags:
+		return angles.reshape(shape), clamped.reshape(shape[:-1]), saturated.reshape(shape)
+	return angles.reshape(shape)
+
+
+class LegKinematics:
+	# Closed-form IK for one leg with every length-derived constant computed once.
+	# solve() allocates nothing: it writes base/hip/knee (degrees, joint signs applied) into slots.
+	# Reachability: the foot must lie between min_reach and max_reach from the hip joint.
+	# Targets outside that shell are moved onto it with clamp_to_reach and results outside
+	# the joint limits are clamped to them, as in solve_ik_batch.
+	__slots__ = ("upper_len", "upper_len_squared", "thigh_len", "knee_sum", "knee_denominator",
+				 "hip_difference", "hip_denominator", "min_reach", "max_reach",
+				 "base_sign", "hip_sign", "knee_sign", "limits",
+				 "base", "hip", "knee")
+
+	def __init__(self, upper_len, thigh_len, shank_len, signs=(1, 1, 1), limits=None):
+		self.upper_len = upper_len
+		self.upper_len_squared = upper_len ** 2
+		self.thigh_len = thigh_len
+		self.knee_sum = thigh_len ** 2 + shank_len ** 2
+		self.knee_denominator = 2 * thigh_len * shank_len
+		self.hip_difference = thigh_len ** 2 - shank_len ** 2
+		self.hip_denominator = 2 * thigh_len
+		self.min_reach = abs(thigh_len - shank_len)
+		self.max_reach = thigh_len + shank_len
+		self.base_sign, self.hip_sign, self.knee_sign = signs
+		# ((base_min, base_max), (hip_min, hip_max), (knee_min, knee_max)) in output degrees
+		self.limits = limits or ((-math.inf, math.inf),) * 3
+		self.base = 0.0
+		self.hip = 0.0
+		self.knee = 0.0
+
+	def solve(self, x, y, z):
+		radius = math.sqrt(z * z + x * x)
+		if radius:
+			sin_base = x / radius
+			base_angle = math.asin(sin_base)
+			upper_x = self.upper_len * sin_base
+			upper_z = -self.upper_len * abs(z) / radius
+		else:
+			base_angle = 0.0
+			upper_x = 0.0
+			upper_z = -self.upper_len
+		if not self.upper_len:
+			raise ValueError("One of the vectors is zero-length.")
+
+		dx = x - upper_x
+		dz = z - upper_z
+		distance = math.sqrt(dx * dx + y * y + dz * dz)
+		if distance == 0.0:
+			raise ValueError("One of the vectors is zero-length.")
+		if distance > self.max_reach or distance < self.min_reach:
+			dx, y, dz, distance, _ = clamp_to_reach(dx, y, dz, distance, self.min_reach, self.max_reach)
+			x = upper_x + dx
+			z = upper_z + dz
+
+		knee_angle = -(math.pi - math.acos(bound(
+			(self.knee_sum - distance * distance) / self.knee_denominator, -1, 1)))
+		# Angle between (hip joint - base) and (hip joint - foot) without building either vector
+		cos_inter = (self.upper_len_squared - upper_x * x - upper_z * z) / (self.upper_len * distance)
+		inter_angle = math.copysign(math.pi - math.acos(bound(cos_inter, -1.0, 1.0)), y)
+		hip_angle = inter_angle - math.acos(bound(
+			(self.hip_difference + distance * distance) / (self.hip_denominator * distance), -1, 1))
+
+		(base_min, base_max), (hip_min, hip_max), (knee_min, knee_max) = self.limits
+		self.base = bound(math.degrees(base_angle) * self.base_sign, base_min, base_max)
+		self.hip = bound(math.degrees(hip_angle) * self.hip_sign, hip_min, hip_max)
+		self.knee = bound(math.degrees(knee_angle) * self.knee_sign, knee_min, knee_max)
+
+
 class Leg:
 	def __init__(self, pca, default_settings: dict, private_settings: dict):
 		self.base_channel = pca.channels[private_settings.get("base_channel")]
@@ -83,12 +329,31 @@ class Leg:
 
 		self.knee_min_angle = default_settings.get("knee_min_angle") + private_settings.get("knee_offset")
 		self.knee_max_angle = default_settings.get("knee_max_angle") + private_settings.get("knee_offset")
+		self.build_kinematics()
 
 		self.base_angle = 0
 		self.hip_angle = 0
 		self.knee_angle = 0
 
+	def build_kinematics(self):
+		self.base_pulse = pulse_table(self.base_min_angle, self.base_max_angle)
+		self.hip_pulse = pulse_table(self.hip_min_angle, self.hip_max_angle)
+		self.knee_pulse = pulse_table(self.knee_min_angle, self.knee_max_angle)
+		self.kinematics = LegKinematics(
+			self.upper_len, self.thigh_len, self.shank_len,
+			(self.private_settings.get("base"), self.private_settings.get("hip"), self.private_settings.get("knee")),
+			((self.base_min_angle, self.base_max_angle), (self.hip_min_angle, self.hip_max_angle),
+			 (self.knee_min_angle, self.knee_max_angle)))
+
 	def reset_angles(self, default_settings: dict, private_settings: dict):
+		# Re-apply calibration: limits, offsets, joint signs and link lengths (channels stay as they are)
+		self.default_settings = default_settings
+		self.private_settings = private_settings
+		self.upper_len = private_settings.get("upper_len")
+		self.thigh_len = private_settings.get("thigh_len")
+		self.shank_len = private_settings.get("shank_len")
+		self.thigh_len_squared = self.thigh_len ** 2
+		self.shank_len_squared = self.shank_len ** 2
 
 		# Joint angle limits (in degrees)
 		self.base_min_angle = default_settings.get("base_min_angle") + private_settings.get("base_offset")
@@ -99,50 +364,32 @@ class Leg:
 
 		self.knee_min_angle = default_settings.get("knee_min_angle") + private_settings.get("knee_offset")
 		self.knee_max_angle = default_settings.get("knee_max_angle") + private_settings.get("knee_offset")
+		self.build_kinematics()
 
 	def go_to_position(self, x, y, z):
-		c = Coordinate(x, y, z)
-		if z or x:
-			base_angle = math.asin(x / math.sqrt(z ** 2 + x ** 2))
-		else:
-			base_angle = 0
-		self.base_angle = math.degrees(base_angle)
-		upper_coord = Coordinate(0, 0, 0)
-		upper_coord.x = self.upper_len * math.sin(base_angle)
-		upper_coord.z = -self.upper_len * math.cos(base_angle)
-		# print(upper_coord)
-		# print("distance to desired", (upper_coord - c).length())
-		left_distance = (upper_coord - c).length()
-		# print(left_distance, self.thigh_len, self.shank_len)
-		knee_angle = math.pi - math.acos(bound(
-			(self.thigh_len ** 2 + self.shank_len ** 2 - left_distance ** 2) / (2 * self.thigh_len * self.shank_len),
-			-1, 1))
-		knee_angle *= -1
-		top_vector = [upper_coord.x, upper_coord.y, upper_coord.z]
-		bottom_vector = [upper_coord.x - x, upper_coord.y - y, upper_coord.z - z]
-		inter_angle = math.copysign(math.pi - angle_between_vectors(top_vector, bottom_vector), y)
-		# print("inter_angle;", math.degrees(inter_angle))
-		hip_angle = - math.acos(bound(
-			(self.thigh_len ** 2 - self.shank_len ** 2 + left_distance ** 2) / (2 * self.thigh_len * left_distance), -1,
-			1)) +  inter_angle
-		# print("hip angle: ",math.degrees(hip_angle))
-		# print("knee angle: ", math.degrees(knee_angle))
-
-		self.base_angle = math.degrees(base_angle)
-		self.hip_angle = math.degrees(hip_angle)
-		self.knee_angle = math.degrees(knee_angle)
-		self.base_angle *= self.private_settings.get("base")
-		self.hip_angle *= self.private_settings.get("hip")
-		self.knee_angle *= self.private_settings.get("knee")
+		kinematics = self.kinematics
+		kinematics.solve(x, y, z)
+		self.base_angle = kinematics.base
+		self.hip_angle = kinematics.hip
+		self.knee_angle = kinematics.knee
+
+	def solve_positions(self, targets):
+		# Batch IK for this leg over an (N, 3) array of targets, e.g. a whole gait cycle.
+		# Leaves the current angles untouched.
+		return solve_ik_batch(targets, self.upper_len, self.thigh_len, self.shank_len,
+							  self.private_settings.get("base"),
+							  self.private_settings.get("hip"),
+							  self.private_settings.get("knee"),
+							  self.kinematics.limits)
 
 	def set_angles(self):
 		# 	Update the servo channels based on computed duty cycles.
 		# print("Setting angles: Base:", self.base_angle,
 		# 	  "Hip:", self.hip_angle,
 		# 	  "Knee:", self.knee_angle)
-		self.base_channel.duty_cycle = angle_to_pulse(self.base_angle, self.base_min_angle, self.base_max_angle)
-		self.hip_channel.duty_cycle = angle_to_pulse(self.hip_angle, self.hip_min_angle, self.hip_max_angle)
-		self.knee_channel.duty_cycle = angle_to_pulse(self.knee_angle, self.knee_min_angle, self.knee_max_angle)
+		self.base_channel.duty_cycle = self.base_pulse.lookup(self.base_angle)
+		self.hip_channel.duty_cycle = self.hip_pulse.lookup(self.hip_angle)
+		self.knee_channel.duty_cycle = self.knee_pulse.lookup(self.knee_angle)
 
 
 class Head:
@@ -161,10 +408,15 @@ class Head:
 		self.horizontal_hard_max = settings.get("horizontal_hard_max")
 		self.vertical_hard_min = settings.get("vertical_hard_min")
 		self.vertical_hard_max = settings.get("vertical_hard_max")
+		self.build_pulse_tables()
 		self.horizontal_sign = settings.get("horizontal")
 		self.vertical_sign = settings.get("vertical")
 
 		self.step = settings.get("step")
+		# Head speed in degrees per second at full joystick deflection; used when move() gets dt
+		self.speed = settings.get("speed")
+		# False while a motion planner writes the head channels, so move() only updates the targets
+		self.immediate = True
 
 	def reset_angles(self, settings):
 		self.vert_offset = settings.get("vertical_offset")
@@ -179,22 +431,29 @@ class Head:
 		self.horizontal_hard_max = settings.get("horizontal_hard_max")
 		self.vertical_hard_min = settings.get("vertical_hard_min")
 		self.vertical_hard_max = settings.get("vertical_hard_max")
+		self.build_pulse_tables()
 
+	def build_pulse_tables(self):
+		self.vertical_pulse = pulse_table(self.vertical_hard_min, self.vertical_hard_max)
+		self.horizontal_pulse = pulse_table(self.horizontal_hard_min, self.horizontal_hard_max)
 
-	def move(self, right, up):
-		self.current_vert += self.step * up * self.vertical_sign
-		self.current_hor += self.step * right * self.horizontal_sign
+	def move(self, right, up, dt=None):
+		step = self.speed * dt if dt is not None and self.speed else self.step
+		self.current_vert += step * up * self.vertical_sign
+		self.current_hor += step * right * self.horizontal_sign
 		self.current_vert = min(max(self.current_vert, self.vertical_min), self.vertical_max)
 		self.current_hor = min(max(self.current_hor, self.horizontal_min), self.horizontal_max)
 		# print(self.current_vert, self.current_hor)
-		self.set_angles()
+		if self.immediate:
+			self.set_angles()
 
 	def set_angles(self):
-		self.vertical.duty_cycle = angle_to_pulse(self.current_vert, self.vertical_hard_min, self.vertical_hard_max)
-		self.horizontal.duty_cycle = angle_to_pulse(self.current_hor, self.horizontal_hard_min, self.horizontal_hard_max)
+		self.vertical.duty_cycle = self.vertical_pulse.lookup(self.current_vert)
+		self.horizontal.duty_cycle = self.horizontal_pulse.lookup(self.current_hor)
 
 if __name__ == "__main__":
-	# pass
+	from setting_reader import read_settings
+
 	class DummyChannel:
 		def __init__(self):
 			self.duty_cycle = 0
@@ -204,10 +463,10 @@ if __name__ == "__main__":
 			self.channels = []
 			for i in range(16):
 				self.channels.append(DummyChannel())
-	default_settings = {}
-	leg = Leg(DummyPca(), DummyPca(), DummyPca())
 
-	leg.hip_angle = 0
-	leg.knee_angle = 0
-	leg.knee_min_angle = 0
+	settings, default, front_left_s, front_right_s, rear_left_s, rear_right_s, general, head_s = read_settings("settings.json")
+	leg = Leg(DummyPca(), default, front_left_s)
+	leg.go_to_position(0, 0, -60)
 	leg.set_angles()
+	print(leg.base_angle, leg.hip_angle, leg.knee_angle)
+	print(leg.base_channel.duty_cycle, leg.hip_channel.duty_cycle, leg.knee_channel.duty_cycle)
@@ -0,0 +1,83 @@
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"DOGFR\x00\x01\x00"
+# magic, record size, capacity, records written, wall clock minus time.monotonic() at open
+HEADER = struct.Struct("<8sIIQd")
+_COUNT = struct.Struct("<Q")
+_COUNT_OFFSET = 16
+# One control tick, 256 bytes:
+#   tick, time.monotonic() at tick start, dt, seconds spent in commit(), Controller.phase,
+#   8 joystick axes (AXES order), 4 leg path indices (front_left, front_right, rear_left, rear_right),
+#   14 joint target angles (OveralController.joint_channels order), 16 PCA9685 duty cycles
+RECORD = struct.Struct("<Qdddd8d4H14d16H")
+JOINTS = 14
+
+
+class FlightRecord:
+	__slots__ = ("tick", "timestamp", "dt", "commit_seconds", "phase", "axes", "positions", "angles", "duties")
+
+	def __init__(self, values):
+		self.tick, self.timestamp, self.dt, self.commit_seconds, self.phase = values[:5]
+		self.axes = values[5:13]
+		self.positions = values[13:17]
+		self.angles = values[17:17 + JOINTS]
+		self.duties = values[17 + JOINTS:]
+
+
+class FlightRecorder:
+	# Always-on ring of the last `capacity` control ticks in a memory-mapped file.
+	# record() is a single struct.pack_into into the map; the kernel writes dirty pages back
+	# on its own, so the control loop never waits for the SD card and a crash of the process
+	# still leaves the recording on disk. The recording of the previous run is kept as <path>.prev.
+	def __init__(self, path, capacity=30000):
+		self.path = path
+		self.capacity = capacity
+		if os.path.exists(path):
+			os.replace(path, path + ".prev")
+		size = HEADER.size + capacity * RECORD.size
+		fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			os.ftruncate(fd, size)
+			self.map = mmap.mmap(fd, size)
+		finally:
+			os.close(fd)
+		self.count = 0
+		self.clock_offset = time.time() - time.monotonic()
+		self.write_header()
+
+	def write_header(self):
+		HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, self.capacity, self.count, self.clock_offset)
+
+	def record(self, tick, timestamp, dt, commit_seconds, axes, controller):
+		# axes: the joystick snapshot used this tick; controller: the OveralController after commit()
+		gait = controller.controller
+		targets, _ = controller.joint_targets()
+		offset = HEADER.size + (self.count % self.capacity) * RECORD.size
+		RECORD.pack_into(self.map, offset, tick, timestamp, dt, commit_seconds, gait.phase, *axes,
+						 gait.front_left_pos, gait.front_right_pos, gait.rear_left_pos, gait.rear_right_pos,
+						 *targets, *controller.frame.pending)
+		self.count += 1
+		_COUNT.pack_into(self.map, _COUNT_OFFSET, self.count)
+
+	def close(self):
+		self.write_header()
+		self.map.flush()
+		self.map.close()
+
+
+def read_recording(path):
+	# Records of a FlightRecorder file, oldest first
+	with open(path, "rb") as f:
+		data = f.read()
+	magic, record_size, capacity, count, clock_offset = HEADER.unpack_from(data)
+	if magic != MAGIC or record_size != RECORD.size:
+		raise ValueError(f"{path} is not a flight recording of this version")
+	first = max(0, count - capacity)
+	records = []
+	for i in range(first, count):
+		offset = HEADER.size + (i % capacity) * RECORD.size
+		records.append(FlightRecord(RECORD.unpack_from(data, offset)))
+	return records, clock_offset
@@ -0,0 +1,84 @@
+import logging
+import time
+
+_HEADER = 8  # int64 sequence number of the latest complete frame
+_SLOT_HEADER = 24  # int64 sequence number, length and wall clock capture time (ns) of the frame in the slot
+
+
+def ring_size(slots, slot_size):
+	# Bytes needed for a FrameRing, e.g. to size a multiprocessing.shared_memory block
+	return _HEADER + slots * (_SLOT_HEADER + slot_size)
+
+
+class FrameRing:
+	# Preallocated ring of `slots` JPEG frames of at most `slot_size` bytes each.
+	# write() copies a frame into the oldest slot and returns its sequence number (1, 2, ...);
+	# readers get a memoryview of that slot with read(seq), so the encoder, the analysis stage
+	# and every streaming client share one copy of each frame and nothing is allocated per frame.
+	# A slot is reused `slots` frames later: its sequence number is cleared while it is being
+	# rewritten, so readers check valid(seq) after using a view that might have been overwritten.
+	# buffer may be any writable buffer of at least ring_size(slots, slot_size) bytes, e.g. shared memory.
+	def __init__(self, slots=8, slot_size=512 * 1024, buffer=None):
+		self.slots = slots
+		self.slot_size = slot_size
+		self.buffer = buffer if buffer is not None else bytearray(ring_size(slots, slot_size))
+		self.view = memoryview(self.buffer)
+		self.header = self.view[:_HEADER].cast('q')
+		self.slot_headers = []
+		self.slot_data = []
+		for i in range(slots):
+			start = _HEADER + i * (_SLOT_HEADER + slot_size)
+			self.slot_headers.append(self.view[start:start + _SLOT_HEADER].cast('q'))
+			self.slot_data.append(self.view[start + _SLOT_HEADER:start + _SLOT_HEADER + slot_size])
+		self.written = 0
+		self.oversized = 0
+
+	def write(self, frame):
+		# Single writer. Returns the sequence number, or None when the frame does not fit a slot.
+		frame = memoryview(frame).cast('B')
+		length = frame.nbytes
+		if length > self.slot_size:
+			if not self.oversized:
+				logging.warning(f"Frame of {length} bytes does not fit a {self.slot_size} byte slot, dropping")
+			self.oversized += 1
+			return None
+		seq = self.header[0] + 1
+		slot = seq % self.slots
+		header = self.slot_headers[slot]
+		header[0] = 0
+		self.slot_data[slot][:length] = frame
+		header[1] = length
+		header[2] = time.time_ns()
+		header[0] = seq
+		self.header[0] = seq
+		self.written += 1
+		return seq
+
+	def read(self, seq):
+		# memoryview of frame `seq`, or None if it has already been overwritten
+		header = self.slot_headers[seq % self.slots]
+		if header[0] != seq:
+			return None
+		return self.slot_data[seq % self.slots][:header[1]]
+
+	def timestamp(self, seq):
+		# time.time() at which frame `seq` was written; only meaningful while valid(seq)
+		return self.slot_headers[seq % self.slots][2] / 1e9
+
+	def valid(self, seq):
+		return self.slot_headers[seq % self.slots][0] == seq
+
+	def release(self):
+		# Drop the views so that a shared memory block can be closed
+		for view in self.slot_headers + self.slot_data:
+			view.release()
+		self.header.release()
+		self.view.release()
+
+	def stats(self):
+		return {
+			"slots": self.slots,
+			"slot_size": self.slot_size,
+			"written": self.written,
+			"oversized": self.oversized,
+		}
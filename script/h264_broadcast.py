@@ -0,0 +1,121 @@
+import asyncio
+import io
+import logging
+import struct
+import time
+
+VIDEO_PATH = '/video'
+# Every WebSocket message is this prefix (time.time() when the encoder produced the frame,
+# float64 little endian) followed by one Annex-B access unit
+STAMP = struct.Struct('<d')
+_START_CODE = b'\x00\x00\x01'
+_KEYFRAME_NALS = (5, 7)  # IDR slice, SPS
+
+
+def is_keyframe(frame, scan=256):
+	# True if one of the NAL units starting in the first `scan` bytes is an IDR slice or an SPS.
+	# Picamera2's H264Encoder (repeat=True) puts SPS, PPS and the IDR slice at the start of a keyframe.
+	position = frame.find(_START_CODE, 0, scan)
+	while position != -1 and position + 3 < len(frame):
+		if frame[position + 3] & 0x1F in _KEYFRAME_NALS:
+			return True
+		position = frame.find(_START_CODE, position + 3, scan)
+	return False
+
+
+class VideoClient:
+	__slots__ = ("queue", "waiting", "sent", "dropped", "bytes_sent")
+
+	def __init__(self, queue_frames):
+		self.queue = asyncio.Queue(queue_frames)
+		self.waiting = True  # for a keyframe; a decoder cannot start from a P frame
+		self.sent = 0
+		self.dropped = 0
+		self.bytes_sent = 0
+
+
+class H264Broadcaster:
+	# Fans the encoder's Annex-B access units out to every WebSocket client on VIDEO_PATH.
+	# Unlike JPEG, H.264 frames depend on their predecessors, so a client cannot simply skip to
+	# the newest frame: each client has a short queue, and a client whose queue overflows drops
+	# everything up to the next keyframe instead. Memory stays bounded by max_clients queues.
+	def __init__(self, max_clients=8, queue_frames=30):
+		self.max_clients = max_clients
+		self.queue_frames = queue_frames
+		self.loop = None
+		self.clients = set()
+		self.frames_published = 0
+		self.keyframes = 0
+		self.bytes_published = 0
+
+	def start(self):
+		# Called from the event loop that serves the WebSocket
+		self.loop = asyncio.get_running_loop()
+
+	def publish(self, frame, timestamp):
+		# Thread-safe; called from the encoder thread
+		loop = self.loop
+		if loop is not None:
+			loop.call_soon_threadsafe(self._publish, STAMP.pack(timestamp) + frame, is_keyframe(frame))
+
+	def _publish(self, message, keyframe):
+		self.frames_published += 1
+		self.keyframes += keyframe
+		self.bytes_published += len(message) - STAMP.size
+		for client in self.clients:
+			if client.waiting:
+				if not keyframe:
+					client.dropped += 1
+					continue
+				client.waiting = False
+			if client.queue.full():
+				# Too far behind: throw the backlog away and resynchronise on the next keyframe
+				client.dropped += client.queue.qsize() + 1
+				while not client.queue.empty():
+					client.queue.get_nowait()
+				client.waiting = True
+				continue
+			client.queue.put_nowait(message)
+
+	async def handle(self, websocket):
+		if len(self.clients) >= self.max_clients:
+			await websocket.close(1013, "Too many video clients")
+			return
+		client = VideoClient(self.queue_frames)
+		self.clients.add(client)
+		try:
+			while True:
+				message = await client.queue.get()
+				await websocket.send(message)
+				client.sent += 1
+				client.bytes_sent += len(message) - STAMP.size
+		except Exception as e:
+			logging.warning(f"Video client disconnected: {e}")
+		finally:
+			self.clients.discard(client)
+
+	def stats(self):
+		clients = tuple(self.clients)  # may be called from another thread
+		return {
+			"clients": len(clients),
+			"published": self.frames_published,
+			"keyframes": self.keyframes,
+			"bytes": self.bytes_published,
+			"sent": [client.sent for client in clients],
+			"dropped": [client.dropped for client in clients],
+		}
+
+
+class H264Output(io.BufferedIOBase):
+	# File-like sink for Picamera2's FileOutput: every write() is one encoded access unit
+	def __init__(self, broadcaster):
+		self.broadcaster = broadcaster
+		self.frames_received = 0
+
+	def write(self, buf):
+		self.frames_received += 1
+		self.broadcaster.publish(buf, time.time())
+		return len(buf)
+
+	def stats(self):
+		return {"received": self.frames_received}
@@ -0,0 +1,72 @@
+import os
+import time
+from collections import deque
+
+from pwm_frame import FakeI2CDevice, LED0_ON_L, CHANNEL_COUNT
+
+# "hardware" drives the real PCA9685 over I2C, "sim" records the writes instead.
+# The DOG_BACKEND environment variable overrides general.backend from settings.json.
+BACKEND_ENV = "DOG_BACKEND"
+
+
+def backend_name(general=None):
+	default = general.get("backend", "hardware") if general else "hardware"
+	return os.environ.get(BACKEND_ENV, default)
+
+
+def registers_to_duty(on, off):
+	# Inverse of pwm_frame.duty_to_registers (the low 4 bits of the 16-bit value are lost)
+	if on & 0x1000:
+		return 0xFFFF
+	if off & 0x1000:
+		return 0
+	return off << 4
+
+
+class RecordingI2CDevice(FakeI2CDevice):
+	# Fake bus that also decodes LEDn register writes into (timestamp, channel, duty_cycle)
+	def __init__(self, history=100_000):
+		super().__init__()
+		self.writes = deque(maxlen=history)
+
+	def write(self, buf, *, start=0, end=None):
+		super().write(buf, start=start, end=end)
+		now = time.monotonic()
+		register = buf[start]
+		length = (end if end is not None else len(buf)) - start - 1
+		first = max(0, (register - LED0_ON_L) // 4)
+		last = min(CHANNEL_COUNT, (register - LED0_ON_L + length) // 4)
+		for channel in range(first, last):
+			self.writes.append((now, channel, self.duty_cycle(channel)))
+
+	def duty_cycle(self, channel):
+		return registers_to_duty(*self.channel_registers(channel))
+
+
+class SimulatedPCA9685:
+	# Drop-in for adafruit_pca9685.PCA9685 as far as this project uses it (i2c_device, frequency)
+	def __init__(self):
+		self.i2c_device = RecordingI2CDevice()
+		self.frequency = 50
+
+	@property
+	def writes(self):
+		return self.i2c_device.writes
+
+	def duty_cycles(self):
+		# What the chip's LEDn registers currently hold, decoded back to 16-bit duty cycles
+		return [self.i2c_device.duty_cycle(channel) for channel in range(CHANNEL_COUNT)]
+
+
+def open_pca(backend="hardware"):
+	if backend == "sim":
+		return SimulatedPCA9685()
+	if backend != "hardware":
+		raise ValueError(f"Unknown backend: {backend}")
+	import busio
+	from adafruit_pca9685 import PCA9685
+	# Initialize I2C bus using the Pi's default SCL and SDA pins
+	i2c = busio.I2C(3, 2)
+	pca = PCA9685(i2c)
+	pca.frequency = 50  # Set frequency to 50Hz for servo control
+	return pca
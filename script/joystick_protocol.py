@@ -0,0 +1,51 @@
+import struct
+
+# Binary joystick packet, little endian, 10 bytes:
+#   uint16 sequence number (wraps), then int8 joy1.x, joy1.y, joy2.x, joy2.y, joy3.x, joy3.y,
+#   keyboard.x, keyboard.y with axes scaled so that 127 == 1.0
+PACKET = struct.Struct('<H8b')
+AXES = (
+	("joy1", "x"), ("joy1", "y"),
+	("joy2", "x"), ("joy2", "y"),
+	("joy3", "x"), ("joy3", "y"),
+	("keyboard", "x"), ("keyboard", "y"),
+)
+AXIS_SCALE = 1 / 127
+
+
+def encode_packet(seq, axes):
+	# Client side reference encoder, used for testing and benchmarks
+	return PACKET.pack(seq & 0xFFFF, *(max(-127, min(127, round(value * 127))) for value in axes))
+
+
+class BinaryJoystickDecoder:
+	# Decodes packets into the preallocated axes list. One decoder per connection:
+	# packets whose sequence number is not newer than the last accepted one (modulo 2**16)
+	# are duplicates or arrived out of order and are discarded.
+	def __init__(self):
+		self.axes = [0.0] * len(AXES)
+		self.last_seq = None
+		self.accepted = 0
+		self.discarded = 0
+
+	def decode(self, data):
+		if len(data) != PACKET.size:
+			raise ValueError(f"Joystick packet must be {PACKET.size} bytes, got {len(data)}")
+		seq = PACKET.unpack_from(data)[0]
+		if self.last_seq is not None and not 0 < ((seq - self.last_seq) & 0xFFFF) < 0x8000:
+			self.discarded += 1
+			return False
+		self.last_seq = seq
+		axes = self.axes
+		# Axis bytes start after the 2-byte sequence number; convert to signed int8
+		for i in range(len(axes)):
+			value = data[2 + i]
+			axes[i] = (value - 256 if value > 127 else value) * AXIS_SCALE
+		self.accepted += 1
+		return True
+
+
+if __name__ == '__main__':
+	decoder = BinaryJoystickDecoder()
+	for seq in (1, 2, 2, 1, 3, 0xFFFF, 0):
+		print(seq, decoder.decode(encode_packet(seq, [0.5, -1, 0, 0, 0.25, 0, 0, 1])), decoder.axes[:2])
@@ -1,101 +1,179 @@
 #!/usr/bin/env python3
 
+import time
+
+PROCESS_START = time.monotonic()
+
 import io
 import threading
-import time
 import logging
 import asyncio
 import socketserver
 from http import server
-import websockets
-from picamera2 import Picamera2
-from picamera2.encoders import JpegEncoder
-from picamera2.outputs import FileOutput
 import json
-import overal_controller
-from camera import *
+import os
+from hardware import backend_name
+from profiler import PROFILER
+from control_loop import ControlLoop, ControlProcess, pin_to_cpus
+from frame_ring import FrameRing
+from mjpeg_broadcast import MJPEGBroadcaster, STREAM_PATH
+from stream_adapter import StreamAdapter
+from h264_broadcast import H264Broadcaster, H264Output, VIDEO_PATH
+from joystick_protocol import BinaryJoystickDecoder
+from control_input import *
+from setting_reader import read_settings
 
 # === Configuration ===
 
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 HTTP_PORT = 8000
+STREAM_PORT = 8001
 WS_PORT = 8765
+MAX_STREAM_CLIENTS = 8
+FRAME_SLOTS = 8  # frames kept in the ring; a slow client skips ahead rather than holding frames
+FRAME_SLOT_SIZE = 512 * 1024  # largest JPEG accepted, 640x480 frames are typically 30-100 KB
+SETTINGS = read_settings("settings.json")[0]
+# "hardware" for the Pi camera and PCA9685, "sim" for a synthetic camera and recorded servo writes
+BACKEND = backend_name(SETTINGS["general"])
+CAMERA_SETTINGS = SETTINGS.get("camera", {})
+# Low resolution YUV stream analysed on the robot, results are pushed to WebSocket clients
+LORES_SETTINGS = CAMERA_SETTINGS.get("lores", {})
+# Bounds for lowering JPEG quality, frame rate and resolution under control or Wi-Fi pressure
+ADAPTIVE_SETTINGS = CAMERA_SETTINGS.get("adaptive", {})
+# "mjpeg" on STREAM_PORT, or "h264" from the hardware encoder over the WebSocket on VIDEO_PATH
+STREAM_MODE = CAMERA_SETTINGS.get("stream", "mjpeg")
+H264_SETTINGS = CAMERA_SETTINGS.get("h264", {})
+# Run the gait/servo loop in its own process pinned to CONTROL_CPU instead of a thread
+MULTIPROCESS = SETTINGS["general"].get("multiprocess", False)
+CONTROL_CPU = SETTINGS["general"].get("control_cpu", 3)
 
-# === Shared joystick state ===
-joystick_state = {
-	"joy1": {"x": 0.0, "y": 0.0},
-	"joy2": {"x": 0.0, "y": 0.0},
-	"joy3": {"x": 0.0, "y": 0.0},
-	"keyboard": {"x": 0, "y": 0}
-}
-joystick_lock = threading.Lock()
+# === Startup stages: servo control first, camera and vision stack in the background ===
+startup_times = {}
+
+
+def startup_stage_done(name, started):
+	now = time.monotonic()
+	startup_times[name] = {"seconds": now - started, "since_start": now - PROCESS_START}
+	print(f"[Startup] {name} ready in {now - started:.2f}s ({now - PROCESS_START:.2f}s since start)")
+
+
+# === Shared joystick state (lock-free, written by the WebSocket loop) ===
+control_input = ControlInput()
 
 
 # === MJPEG output handler for streaming ===
 class StreamingOutput(io.BufferedIOBase):
-	def __init__(self):
+	# process is an optional analysis stage (buffer -> buffer). Without it encoder output
+	# is published as is and no processing thread is started.
+	# Finished frames are copied once into `ring` and on_frame receives their sequence
+	# number, e.g. MJPEGBroadcaster.publish; consumers read the frame from the ring.
+	# write() and the processing thread share a single slot guarded by a condition:
+	# the thread sleeps until a frame arrives and an unprocessed frame is overwritten (dropped).
+	def __init__(self, ring, process=None, on_frame=None):
 		self.raw_frame = None
-		self.frame = None
-		self.condition = threading.Condition()
-		self.lock = threading.Lock()
-		self.proc_thread = threading.Thread(target=self._process_loop, daemon=True)
-		self.proc_thread.start()
+		self.ring = ring
+		self.process = process
+		self.on_frame = on_frame
+		self.frame_ready = threading.Condition()
+		self.frames_received = 0
+		self.frames_dropped = 0
+		self.frames_processed = 0
+		self.frames_served = 0
+		self.process_stage = PROFILER.stage("camera.process")
+		if process is not None:
+			self.proc_thread = threading.Thread(target=self._process_loop, daemon=True)
+			self.proc_thread.start()
 
 	def write(self, buf):
-		with self.lock:
+		self.frames_received += 1
+		if self.process is None:
+			self._publish(buf)
+			return len(buf)
+		with self.frame_ready:
+			if self.raw_frame is not None:
+				self.frames_dropped += 1
 			self.raw_frame = buf  # overwrite old unprocessed frame
+			self.frame_ready.notify()
 		return len(buf)
 
 	def _process_loop(self):
 		while True:
-			with self.lock:
-				if self.raw_frame is None:
-					time.sleep(0.002)
-					continue
+			with self.frame_ready:
+				while self.raw_frame is None:
+					self.frame_ready.wait()
 				buf = self.raw_frame
 				self.raw_frame = None
+			start = time.perf_counter()
 			try:
-				processed = process_image(buf)
+				processed = self.process(buf)
 			except Exception as e:
 				logging.warning(f"Frame processing failed: {e}")
 				continue
-			with self.condition:
-				self.frame = processed
-				self.condition.notify_all()
+			self.process_stage.record_since(start)
+			self.frames_processed += 1
+			self._publish(processed)
+
+	def _publish(self, frame):
+		seq = self.ring.write(frame)
+		if seq is None:
+			return
+		self.frames_served += 1
+		if self.on_frame is not None:
+			self.on_frame(seq)
+
+	def stats(self):
+		return {
+			"received": self.frames_received,
+			"dropped": self.frames_dropped,
+			"processed": self.frames_processed,
+			"served": self.frames_served,
+			"ring": self.ring.stats(),
+		}
 
 
 # === HTTP server for index.html and MJPEG ===
+# Everything the page needs is served from static/, so it works on a robot LAN without internet.
+# jmuxer.min.js is the pinned H.264 player, see README.md.
+STATIC_FILES = {
+	'/': ("static/index.html", 'text/html'),
+	'/index.html': ("static/index.html", 'text/html'),
+	'/jmuxer.min.js': ("static/jmuxer.min.js", 'application/javascript'),
+}
+
+
 class MJPEGHandler(server.BaseHTTPRequestHandler):
 	def do_GET(self):
-		if self.path in ('/', '/index.html'):
+		if self.path in STATIC_FILES:
+			path, content_type = STATIC_FILES[self.path]
 			try:
-				with open("static/index.html", "rb") as f:
+				with open(path, "rb") as f:
 					content = f.read()
-				self.send_response(200)
-				self.send_header('Content-Type', 'text/html')
-				self.send_header('Content-Length', len(content))
-				self.end_headers()
-				self.wfile.write(content)
+			except FileNotFoundError:
+				self.send_error(404)
+				return
 			except Exception as e:
-				self.send_error(500, f"Error loading index.html: {e}")
-		elif self.path == '/stream.mjpg':
+				self.send_error(500, f"Error loading {path}: {e}")
+				return
 			self.send_response(200)
-			self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
+			self.send_header('Content-Type', content_type)
+			self.send_header('Content-Length', len(content))
+			self.end_headers()
+			self.wfile.write(content)
+		elif self.path == '/stats.json':
+			content = json.dumps(collect_stats()).encode()
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', len(content))
+			self.send_header('Cache-Control', 'no-cache')
+			self.end_headers()
+			self.wfile.write(content)
+		elif self.path == STREAM_PATH:
+			# The stream itself is served by the asyncio broadcaster
+			host = self.headers.get('Host', 'localhost').split(':')[0]
+			self.send_response(302)
+			self.send_header('Location', f"http://{host}:{STREAM_PORT}{STREAM_PATH}")
 			self.end_headers()
-			try:
-				while True:
-					with output.condition:
-						output.condition.wait()
-						frame = output.frame
-					self.wfile.write(b'--FRAME\r\n')
-					self.send_header('Content-Type', 'image/jpeg')
-					self.send_header('Content-Length', len(frame))
-					self.end_headers()
-					self.wfile.write(frame)
-					self.wfile.write(b'\r\n')
-			except Exception as e:
-				logging.warning(f"Client disconnected: {e}")
 		else:
 			self.send_error(404)
 			self.end_headers()
@@ -107,70 +185,241 @@ class ThreadedHTTPServer(socketserver.ThreadingMixIn, server.HTTPServer):
 
 
 # === WebSocket handler (receives joystick data) ===
+def request_path(websocket):
+	# websockets >= 14 has websocket.request.path; older releases (e.g. the distro package) websocket.path
+	request = getattr(websocket, "request", None)
+	return request.path if request is not None else getattr(websocket, "path", None) or "/"
+
+
 async def ws_handler(websocket):
+	# Text messages are JSON, binary messages use the packed joystick_protocol layout.
+	# The shared state only keeps the newest values, so bursts are coalesced to whatever
+	# the control loop samples on its next tick.
+	# Connections on VIDEO_PATH receive the H.264 stream instead.
+	if request_path(websocket).split('?')[0] == VIDEO_PATH:
+		await h264_broadcaster.handle(websocket)
+		return
+	decoder = BinaryJoystickDecoder()
+	joystick_decoders.add(decoder)
+	ws_clients.add(websocket)
 	try:
+		# Until start_camera has settled stream_mode the client gets the config from publish_config()
+		if camera_settled.is_set():
+			await websocket.send(config_message())
 		while True:
 			data = await websocket.recv()
-			update_joystick_state(data)
+			if isinstance(data, bytes):
+				update_joystick_packet(decoder, data)
+			else:
+				update_joystick_state(data)
 	except Exception as e:
 		logging.warning(f"WebSocket closed: {e}")
+	finally:
+		ws_clients.discard(websocket)
+		joystick_decoders.discard(decoder)
+		for key in closed_joystick_packets:
+			closed_joystick_packets[key] += getattr(decoder, key)
+
+
+# === Binary joystick packets accepted and discarded as stale, for /stats.json ===
+joystick_decoders = set()  # decoders of the open connections
+closed_joystick_packets = {"accepted": 0, "discarded": 0}
+
+
+def joystick_stats():
+	# Called from HTTP threads while connections come and go; the totals may be one packet off
+	decoders = list(joystick_decoders)
+	stats = {key: total + sum(getattr(decoder, key) for decoder in decoders)
+			 for key, total in closed_joystick_packets.items()}
+	stats["connections"] = len(decoders)
+	return stats
+
 
+# === Vision results from the lores analysis, pushed to every WebSocket client ===
+ws_clients = set()
+ws_loop = None
 
-# === Update joystick values into shared dictionary ===
+
+def publish_vision(result):
+	# Thread-safe; called from the analysis thread
+	loop = ws_loop
+	if loop is not None and ws_clients:
+		loop.call_soon_threadsafe(broadcast_text, json.dumps(result))
+
+
+def config_message():
+	return json.dumps({"type": "config", "stream": stream_mode})
+
+
+def publish_config():
+	# Thread-safe; called once stream_mode is final, clients connected before that get it now
+	camera_settled.set()
+	loop = ws_loop
+	if loop is not None and ws_clients:
+		loop.call_soon_threadsafe(broadcast_text, config_message())
+
+
+def broadcast_text(message):
+	import websockets
+	websockets.broadcast(ws_clients, message)
+
+
+# === Update joystick values from a JSON message ===
 def update_joystick_state(json_data):
 	try:
-		data = json.loads(json_data)
-		with joystick_lock:
-			joystick_state["joy1"] = data.get("joy1", {"x": 0, "y": 0})
-			joystick_state["joy2"] = data.get("joy2", {"x": 0, "y": 0})
-			joystick_state["joy3"] = data.get("joy3", {"x": 0, "y": 0})
-			joystick_state["keyboard"] = data.get("keyboard", {"x": 0, "y": 0})
+		control_input.write_state(json.loads(json_data))
 	except Exception as e:
 		logging.warning(f"Failed to parse joystick data: {e}")
 
 
+# === Update joystick values from a binary packet ===
+def update_joystick_packet(decoder, packet):
+	try:
+		if decoder.decode(packet):
+			control_input.write(decoder.axes)
+	except Exception as e:
+		logging.warning(f"Failed to parse joystick packet: {e}")
+
+
 # === Dummy background thread that reacts to joystick input ===
 class DummyBackgroundThread(threading.Thread):
 	def __init__(self):
 		super().__init__(daemon=True)
-		self.Controller = overal_controller.OveralController()
+		self.loop = ControlLoop(control_input, BACKEND)
 
 	def run(self):
-		while True:
-			# time.sleep(1.0 / 30.0)  # ~30Hz
-			with joystick_lock:
-				js = joystick_state.copy()
-			if (-js['joy1']['y'] or js['joy1']['x'] or js['joy2']['x']):
-				self.Controller.iterate(-js['joy1']['y'], js['joy1']['x'], js['joy2']['x'])
-			self.Controller.head.move(js['joy3']['x'], js['joy3']['y'])
-	# print(f"[Dummy] joy1: {js['joy1']} joy2: {js['joy2']} joy3: {js['joy3']} keyboard: {js['keyboard']}")
+		self.loop.run()
+
+	def stop(self):
+		self.loop.stop()
+		self.join(1.0)
+
+
+# === Profiler snapshot served on /stats.json ===
+def control_stats():
+	return control_process.stats() if control_process is not None else dummy_thread.loop.stats()
+
+
+def stage_stats():
+	# In multi-process mode the control.* stages are recorded in the child and read from shared memory
+	stages = PROFILER.snapshot()
+	if control_process is not None:
+		stages.update(control_process.stage_stats())
+	return dict(sorted(stages.items()))
+
+
+def collect_stats():
+	return {
+		"startup": startup_times,
+		"stages": stage_stats(),
+		"control": control_stats(),
+		"joystick": joystick_stats(),
+		"camera": output.stats() if output is not None else None,
+		"stream_mode": stream_mode,
+		"stream": broadcaster.stats(),
+		"video": h264_broadcaster.stats(),
+		"adaptive": stream_adapter.stats() if stream_adapter is not None else None,
+	}
+
+
+# === Camera setup (runs in the background; imports cv2 and picamera2) ===
+camera_source = None
+output = None
+lores_analysis = None
+stream_adapter = None
+frame_ring = FrameRing(FRAME_SLOTS, FRAME_SLOT_SIZE)
+broadcaster = MJPEGBroadcaster(frame_ring, MAX_STREAM_CLIENTS)
+h264_broadcaster = H264Broadcaster(MAX_STREAM_CLIENTS)
+stream_mode = STREAM_MODE
+camera_settled = threading.Event()  # set by start_camera once stream_mode can no longer change
+
+
+def start_camera():
+	global camera_source, output, lores_analysis, stream_adapter, stream_mode
+	started = time.monotonic()
+	try:
+		from camera import open_camera, process_image, LoresAnalyzer, LoresAnalysis
+		lores = (LORES_SETTINGS.get("width", 320), LORES_SETTINGS.get("height", 240)) if LORES_SETTINGS.get("enabled", False) else None
+		camera_source = open_camera(BACKEND, FRAME_WIDTH, FRAME_HEIGHT, vflip=CAMERA_SETTINGS.get("vflip", True), lores=lores)
+		if stream_mode == "h264" and not os.path.exists(STATIC_FILES['/jmuxer.min.js'][0]):
+			logging.warning(f"{STATIC_FILES['/jmuxer.min.js'][0]} is missing (see README.md), streaming MJPEG instead")
+			stream_mode = "mjpeg"
+		if stream_mode == "h264" and not camera_source.supports_h264:
+			logging.warning(f"{type(camera_source).__name__} has no H.264 encoder, streaming MJPEG instead")
+			stream_mode = "mjpeg"
+		if stream_mode == "h264":
+			output = H264Output(h264_broadcaster)
+			camera_source.start_h264(output, H264_SETTINGS.get("bitrate", 1_500_000), H264_SETTINGS.get("iperiod", 30))
+		if stream_mode == "mjpeg":
+			output = StreamingOutput(frame_ring, process_image if CAMERA_SETTINGS.get("analysis", False) else None, broadcaster.publish)
+			camera_source.start(output)
+		if lores is not None:
+			analyzer = LoresAnalyzer(*lores, motion_threshold=LORES_SETTINGS.get("motion_threshold", 25))
+			lores_analysis = LoresAnalysis(camera_source, analyzer, LORES_SETTINGS.get("rate", 5), publish_vision)
+			lores_analysis.start()
+		if stream_mode == "mjpeg" and ADAPTIVE_SETTINGS.get("enabled", False):
+			stream_adapter = StreamAdapter(camera_source, broadcaster, control_stats, ADAPTIVE_SETTINGS)
+			stream_adapter.start()
+	except Exception as e:
+		logging.warning(f"Camera startup failed: {e}")
+		return
+	finally:
+		publish_config()
+	startup_stage_done("camera", started)
 
 
-# === Camera setup ===
-picam2 = Picamera2()
-picam2.configure(picam2.create_video_configuration(main={"size": (FRAME_WIDTH, FRAME_HEIGHT)}))
-output = StreamingOutput()
-picam2.start_recording(JpegEncoder(), FileOutput(output))
+# === Background process startup: servo control comes up first ===
+started = time.monotonic()
+control_process = None
+dummy_thread = None
+if MULTIPROCESS:
+	# Forked before any other thread exists; the joystick state moves into shared memory
+	control_process = ControlProcess(BACKEND, CONTROL_CPU)
+	control_input = control_process.control_input
+	control_process.start()
+	pin_to_cpus(set(range(os.cpu_count() or 1)) - {CONTROL_CPU})
+else:
+	dummy_thread = DummyBackgroundThread()
+	dummy_thread.start()
+startup_stage_done("control", started)
 
 # === HTTP server startup ===
+started = time.monotonic()
 http_server = ThreadedHTTPServer(('', HTTP_PORT), MJPEGHandler)
 http_thread = threading.Thread(target=http_server.serve_forever, daemon=True)
 http_thread.start()
-print(f"[HTTP] MJPEG stream available at http://<this-ip>:{HTTP_PORT}")
+print(f"[HTTP] Control page available at http://<this-ip>:{HTTP_PORT}")
+startup_stage_done("http", started)
 
-# === Background process startup ===
-dummy_thread = DummyBackgroundThread()
-dummy_thread.start()
+camera_thread = threading.Thread(target=start_camera, daemon=True)
+camera_thread.start()
 
 
-# === WebSocket server startup ===
+# === WebSocket server and MJPEG broadcaster startup (one event loop) ===
 async def main_async():
-	print(f"[WebSocket] Listening on ws://<this-ip>:{WS_PORT}/ (no path restriction)")
-	async with websockets.serve(ws_handler, "", WS_PORT):
+	global ws_loop
+	started = time.monotonic()
+	import websockets
+	ws_loop = asyncio.get_running_loop()
+	h264_broadcaster.start()
+	stream_server = await broadcaster.serve("", STREAM_PORT)
+	print(f"[HTTP] MJPEG stream available at http://<this-ip>:{STREAM_PORT}{STREAM_PATH}")
+	print(f"[WebSocket] Listening on ws://<this-ip>:{WS_PORT}/ (H.264 video on {VIDEO_PATH})")
+	async with stream_server, websockets.serve(ws_handler, "", WS_PORT):
+		startup_stage_done("websocket", started)
 		await asyncio.Future()  # keep alive
 
 
 try:
 	asyncio.run(main_async())
 finally:
-	picam2.stop_recording()
+	if stream_adapter is not None:
+		stream_adapter.stop()
+	if lores_analysis is not None:
+		lores_analysis.stop()
+	if camera_source is not None:
+		camera_source.stop()
+	if control_process is not None:
+		control_process.close()
+	if dummy_thread is not None:
+		dummy_thread.stop()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import socket
+
+STREAM_PATH = '/stream.mjpg'
+BOUNDARY = b'FRAME'
+# Kernel send buffer per client. Kept small so that a slow viewer stalls in drain() and skips
+# frames (which StreamAdapter sees) instead of queueing seconds of stale video in the socket.
+SEND_BUFFER = 128 * 1024
+
+
+class StreamClient:
+	__slots__ = ("event", "frame", "sent", "dropped", "torn", "bytes_sent")
+
+	def __init__(self):
+		self.event = asyncio.Event()
+		self.frame = None  # sequence number in the FrameRing
+		self.sent = 0
+		self.dropped = 0
+		self.torn = 0
+		self.bytes_sent = 0
+
+
+class MJPEGBroadcaster:
+	# Fans the latest JPEG out to every /stream.mjpg client from one asyncio loop.
+	# Frames live in a FrameRing and are sent straight from its memoryviews; each client owns
+	# a single latest-frame-wins slot holding a sequence number, so a viewer that is still
+	# sending the previous frame simply skips to the newest one and no frame is kept alive per
+	# client, however slow the viewers are. Only the part of a frame the socket cannot take at
+	# once is copied: the transport must never hold a view of a slot the camera will reuse.
+	def __init__(self, ring, max_clients=8):
+		self.ring = ring
+		self.max_clients = max_clients
+		self.loop = None
+		self.frame = None
+		self.clients = set()
+		self.frames_published = 0
+
+	def publish(self, seq):
+		# Thread-safe; called from the camera/processing thread with a FrameRing sequence number
+		loop = self.loop
+		if loop is not None:
+			loop.call_soon_threadsafe(self._publish, seq)
+
+	def _publish(self, seq):
+		self.frame = seq
+		self.frames_published += 1
+		for client in self.clients:
+			if client.frame is not None:
+				client.dropped += 1
+			client.frame = seq
+			client.event.set()
+
+	async def serve(self, host, port):
+		self.loop = asyncio.get_running_loop()
+		return await asyncio.start_server(self.handle, host, port)
+
+	async def handle(self, reader, writer):
+		try:
+			request = await reader.readline()
+			while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+				pass
+			parts = request.split()
+			if len(parts) < 2 or parts[1].decode('latin-1').split('?')[0] != STREAM_PATH:
+				writer.write(b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+				return
+			if len(self.clients) >= self.max_clients:
+				writer.write(b'HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n')
+				return
+			writer.write(b'HTTP/1.0 200 OK\r\n'
+						 b'Cache-Control: no-cache\r\n'
+						 b'Access-Control-Allow-Origin: *\r\n'
+						 b'Content-Type: multipart/x-mixed-replace; boundary=' + BOUNDARY + b'\r\n\r\n')
+			await self.stream(writer)
+		except (ConnectionError, asyncio.IncompleteReadError) as e:
+			logging.warning(f"Client disconnected: {e}")
+		finally:
+			writer.close()
+
+	async def stream(self, writer):
+		sock = writer.get_extra_info('socket')
+		if sock is not None:
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+		writer.transport.set_write_buffer_limits(high=0)
+		fd = sock.fileno() if sock is not None else None
+		client = StreamClient()
+		client.frame = self.frame
+		if client.frame is not None:
+			client.event.set()
+		self.clients.add(client)
+		try:
+			while True:
+				await client.event.wait()
+				client.event.clear()
+				seq, client.frame = client.frame, None
+				frame = self.ring.read(seq)
+				if frame is None:
+					# The camera lapped this client while it was sending the previous frame
+					client.dropped += 1
+					continue
+				length = len(frame)
+				# X-Timestamp (time.time() when the frame was written) lets stream_benchmark.py measure latency
+				writer.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+							 + str(length).encode() + b'\r\nX-Timestamp: '
+							 + b'%.6f' % self.ring.timestamp(seq) + b'\r\n\r\n')
+				self.send_frame(writer, fd, frame)
+				writer.write(b'\r\n')
+				del frame
+				# The camera lapped this client while the frame was being copied out of its slot
+				if not self.ring.valid(seq):
+					client.torn += 1
+				await writer.drain()
+				client.sent += 1
+				client.bytes_sent += length
+		finally:
+			self.clients.discard(client)
+
+	@staticmethod
+	def send_frame(writer, fd, frame):
+		# Newer asyncio keeps the unsent tail of a memoryview without copying it, and the slot is
+		# rewritten `slots` frames later, possibly before a slow client has drained it. So the
+		# kernel gets the view directly while nothing is queued ahead of it, and the transport
+		# only ever gets a bytes copy of what the socket did not take.
+		sent = 0
+		if fd is not None and not writer.transport.get_write_buffer_size():
+			try:
+				sent = os.write(fd, frame)
+			except (BlockingIOError, InterruptedError):
+				pass
+		if sent < len(frame):
+			writer.write(bytes(frame[sent:]))
+
+	def client_counters(self):
+		# (key, frames sent, frames dropped, bytes sent) of every client; may be called from another thread
+		return [(id(client), client.sent, client.dropped, client.bytes_sent) for client in tuple(self.clients)]
+
+	def stats(self):
+		clients = tuple(self.clients)  # may be called from another thread
+		return {
+			"clients": len(clients),
+			"published": self.frames_published,
+			"sent": [client.sent for client in clients],
+			"dropped": [client.dropped for client in clients],
+			"torn": [client.torn for client in clients],
+		}
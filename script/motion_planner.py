@@ -0,0 +1,52 @@
+import numpy as np
+
+
+class MotionPlanner:
+	# Per-joint velocity and acceleration limited tracking, run once per control tick.
+	# Every joint accelerates towards its target at most max_acceleration, cruises at most at
+	# max_velocity and starts braking early enough to stop on the target, so commanded joint
+	# speeds no longer depend on how large the jump between two gait frames is.
+	# Limits may be scalars or per-joint arrays, in degrees/s and degrees/s^2.
+	def __init__(self, count, max_velocity, max_acceleration):
+		self.count = count
+		self.max_velocity = np.broadcast_to(np.asarray(max_velocity, dtype=np.float64), (count,)).copy()
+		self.max_acceleration = np.broadcast_to(np.asarray(max_acceleration, dtype=np.float64), (count,)).copy()
+		self.position = np.zeros(count)
+		self.velocity = np.zeros(count)
+		self.initialised = False
+		self.settled = False  # every joint stopped on its last target
+
+	def reset(self, position):
+		self.position[:] = position
+		self.velocity[:] = 0
+		self.initialised = True
+		self.settled = True
+
+	def update(self, target, dt):
+		target = np.asarray(target, dtype=np.float64)
+		if not self.initialised:
+			# The real servo positions are unknown at start-up, so the first command is taken as is
+			self.reset(target)
+			return self.position
+		if self.settled and np.array_equal(target, self.position):
+			return self.position
+		error = target - self.position
+		braking_velocity = np.sign(error) * np.sqrt(2 * self.max_acceleration * np.abs(error))
+		desired = np.clip(braking_velocity, -self.max_velocity, self.max_velocity)
+		max_change = self.max_acceleration * dt
+		self.velocity += np.clip(desired - self.velocity, -max_change, max_change)
+		step = self.velocity * dt
+		arrived = (np.abs(step) >= np.abs(error)) & (step * error >= 0)
+		self.position += step
+		self.position[arrived] = target[arrived]
+		self.velocity[arrived] = 0
+		self.settled = bool(arrived.all())
+		return self.position
+
+
+if __name__ == '__main__':
+	planner = MotionPlanner(1, 300, 3000)
+	planner.reset([0])
+	for tick in range(30):
+		planner.update([90], 0.02)
+		print(f"{tick * 0.02:.2f}s {planner.position[0]:7.2f} deg {planner.velocity[0]:7.1f} deg/s")
@@ -1,61 +1,198 @@
-import board
-import busio
-from adafruit_pca9685 import PCA9685
 import time
 from dog import *
 from setting_reader import *
 from controller import *
+from pwm_frame import PwmFrame
+from hardware import backend_name, open_pca
+from motion_planner import MotionPlanner
+from profiler import PROFILER
+
+class CompiledGait:
+	# angles: (path_len, 4, 3) joint angles, duty: per phase tuple of 12 duty cycles in leg channel order.
+	# clamped (path_len, 4) and saturated (path_len, 4, 3) mark the phases whose foot target was out
+	# of reach or whose joints hit their limits; limited is the set of those phases.
+	def __init__(self, angles, duty, clamped, saturated):
+		self.angles = angles
+		self.duty = duty
+		self.clamped = clamped
+		self.saturated = saturated
+		self.limited = set(np.flatnonzero(clamped.any(axis=1) | saturated.any(axis=(1, 2))).tolist())
 
-class OveralController:
-	def __init__(self):
-		# Initialize I2C bus using the Pi's default SCL and SDA pins
-		self.i2c = busio.I2C(3, 2)
-		# Create the PCA9685 instance
-		self.pca = PCA9685(self.i2c)
-		# pca = PCA9685()
-		self.pca.frequency = 50  # Set frequency to 50Hz for servo control
 
+class OveralController:
+	def __init__(self, backend=None):
 		settings, default, front_left_s, front_right_s, rear_left_s, rear_right_s, general, head_s = read_settings("settings.json")
+		self.settings_watcher = SettingsWatcher("settings.json")
+		self.settings_watcher.poll()
+
+		# Real PCA9685 on the Pi's I2C bus, or a simulated one that records every write
+		self.backend = backend or backend_name(general)
+		self.pca = open_pca(self.backend)
+		# Legs and head write into this frame; commit() sends all channels in one I2C burst
+		self.frame = PwmFrame(self.pca.i2c_device)
 
 		self.max_forward_speed = general.get('collinear_max_speed')
 		self.max_side_speed = general.get('perp_max_speed')
 		self.max_rotation_speed = general.get('rotation_max_speed')
 		self.step_count = general.get('step_count')
 		self.pos_update_time = general.get("delay")
+		# Control loop frequency in Hz; gait and head speeds are defined per tick at this rate
+		self.control_rate = general.get("control_rate", 50)
+		# Joystick axes are snapped to this many steps per unit so compiled gaits can be reused
+		self.input_resolution = general.get("input_resolution", 20)
 		print(self.max_forward_speed, self.max_side_speed, self.max_rotation_speed)
 		print(self.step_count, self.pos_update_time)
 
-		self.front_left = Leg(self.pca, default, front_left_s)
-		self.front_right = Leg(self.pca, default, front_right_s)
-		self.rear_left = Leg(self.pca, default, rear_left_s)
-		self.rear_right = Leg(self.pca, default, rear_right_s)
-		self.head = Head(self.pca, head_s)
+		self.front_left = Leg(self.frame, default, front_left_s)
+		self.front_right = Leg(self.frame, default, front_right_s)
+		self.rear_left = Leg(self.frame, default, rear_left_s)
+		self.rear_right = Leg(self.frame, default, rear_right_s)
+		self.head = Head(self.frame, head_s)
+		self.legs = [self.front_left, self.front_right, self.rear_left, self.rear_right]
+		self.leg_channels = []
+		for leg in self.legs:
+			self.leg_channels += [leg.base_channel, leg.hip_channel, leg.knee_channel]
+
+		self.joint_channels = self.leg_channels + [self.head.vertical, self.head.horizontal]
+
+		# Optional slew/acceleration limiting of all 14 joints between IK output and PWM
+		motion = settings.get("motion", {})
+		self.planner = None
+		if motion.get("enabled", False):
+			self.planner = MotionPlanner(len(self.joint_channels), motion.get("max_velocity"), motion.get("max_acceleration"))
+			# commit() writes the head channels from the planner output
+			self.head.immediate = False
+		# Duty cycles of the gait phase the legs were last set to; None after anything else moved them
+		self.phase_duty = None
 
-		self.controller = Controller()
+		# "path" steps through the interpolated reference path by step_count points per tick,
+		# "spline" samples a GaitTrajectory and runs it at gait_frequency cycles per second
+		self.realtime_gait = general.get("gait", "path") == "spline"
+		if self.realtime_gait:
+			trajectory = GaitTrajectory(general.get("duty_factor", 0.7))
+			self.controller = Controller(trajectory, general.get("gait_points", 200))
+			self.controller.set_frequency(general.get("gait_frequency", 0.75))
+		else:
+			self.controller = Controller()
+		self.gait_cache = GaitCache(general.get("gait_cache_size", 16))
+		# Gait frames applied with a leg's target out of reach, and with each joint at a limit
+		self.ik_clamped = np.zeros(len(self.legs), dtype=np.int64)
+		self.ik_saturated = np.zeros((len(self.legs), 3), dtype=np.int64)
 
-		self.last_pos_update_time = time.time()
+		self.compile_stage = PROFILER.stage("gait.compile")
+		self.planner_stage = PROFILER.stage("control.planner")
+		self.i2c_stage = PROFILER.stage("control.i2c")
+
+		self.last_pos_update_time = time.monotonic()
 		self.controller.set_speeds(0, 0, 0, 2)
 		self.controller.height_top = -65
 		self.controller.height_bottom = -75
 		self.controller.trot = True
 
-	def iterate(self, forward, right, rotation):
+	def reload_settings(self):
+		# Apply calibration edits to settings.json while running. Only changed sections are
+		# re-applied; compiled gaits depend on the leg calibration and are dropped when it changes.
+		changed = self.settings_watcher.poll()
+		if not changed:
+			return []
+		settings = self.settings_watcher.settings
+		legs = dict(zip(LEG_SECTIONS, self.legs))
+		updated = apply_settings_changes(changed, settings, legs, self.head)
+		if any(name != 'head' for name in updated):
+			self.gait_cache.clear()
+			self.phase_duty = None
+		if 'general' in changed:
+			general = settings['general']
+			self.max_forward_speed = general.get('collinear_max_speed')
+			self.max_side_speed = general.get('perp_max_speed')
+			self.max_rotation_speed = general.get('rotation_max_speed')
+			self.step_count = general.get('step_count')
+		return updated
+
+	def compile_gait(self):
+		# Precompute joint angles and the final 12 duty cycles for every phase of the current gait
+		angles, clamped, saturated = solve_legs_batch(self.legs, self.controller.positions_table(), return_flags=True)
+		columns = np.empty((len(angles), 3 * len(self.legs)), dtype=np.int64)
+		for i, leg in enumerate(self.legs):
+			columns[:, 3 * i] = leg.base_pulse.lookup_array(angles[:, i, 0])
+			columns[:, 3 * i + 1] = leg.hip_pulse.lookup_array(angles[:, i, 1])
+			columns[:, 3 * i + 2] = leg.knee_pulse.lookup_array(angles[:, i, 2])
+		return CompiledGait(angles, [tuple(row) for row in columns.tolist()], clamped, saturated)
+
+	def current_gait(self):
+		key = self.controller.gait_key()
+		gait = self.gait_cache.get(key)
+		if gait is None:
+			start = time.perf_counter()
+			gait = self.compile_gait()
+			self.gait_cache.put(key, gait)
+			self.compile_stage.record_since(start)
+		return gait
+
+	def apply_phase(self, gait, phase):
+		if phase in gait.limited:
+			self.ik_clamped += gait.clamped[phase]
+			self.ik_saturated += gait.saturated[phase]
+		for leg, (base, hip, knee) in zip(self.legs, gait.angles[phase].tolist()):
+			leg.base_angle = base
+			leg.hip_angle = hip
+			leg.knee_angle = knee
+		self.phase_duty = gait.duty[phase]
+		if self.planner is None:
+			for channel, value in zip(self.leg_channels, gait.duty[phase]):
+				channel.duty_cycle = value
+
+	def joint_targets(self):
+		# Commanded angle and angle -> duty table of every joint, in joint_channels order
+		targets = []
+		tables = []
+		for leg in self.legs:
+			targets += [leg.base_angle, leg.hip_angle, leg.knee_angle]
+			tables += [leg.base_pulse, leg.hip_pulse, leg.knee_pulse]
+		head = self.head
+		targets += [head.current_vert, head.current_hor]
+		tables += [head.vertical_pulse, head.horizontal_pulse]
+		return targets, tables
+
+	def iterate(self, forward, right, rotation, dt=None, now=None):
+		# now: time.monotonic() of this tick, passed in so that a replay can reproduce the "path" gait timing
+		resolution = self.input_resolution
+		forward = round(forward * resolution) / resolution
+		right = round(right * resolution) / resolution
+		rotation = round(rotation * resolution) / resolution
 		self.controller.set_speeds(forward * self.max_forward_speed, right * self.max_side_speed, rotation * self.max_rotation_speed, self.step_count)
 		# self.head.move(head_right, head_up)
 		# self.head.set_angles()
 		# print(forward * self.max_forward_speed, right * self.max_side_speed, rotation * self.max_rotation_speed, self.step_count)
 
-		if time.time() - self.last_pos_update_time > self.pos_update_time / 1000:
-			self.controller.next_point()
-			positions = self.controller.get_positions()
-			# print(positions)
-			self.front_left.go_to_position(*positions[0])
-			self.front_right.go_to_position(*positions[1])
-			self.rear_left.go_to_position(*positions[2])
-			self.rear_right.go_to_position(*positions[3])
-			self.last_pos_update_time = time.time()
-			self.front_left.set_angles()
-			self.front_right.set_angles()
-			self.rear_left.set_angles()
-			self.rear_right.set_angles()
+		if self.realtime_gait:
+			self.controller.advance(dt or 1 / self.control_rate)
+			self.apply_phase(self.current_gait(), self.controller.front_left_pos)
+		else:
+			now = time.monotonic() if now is None else now
+			if now - self.last_pos_update_time > self.pos_update_time / 1000:
+				self.controller.next_point()
+				self.apply_phase(self.current_gait(), self.controller.front_left_pos)
+				self.last_pos_update_time = now
 
+	def commit(self, dt=None):
+		# Flush every channel changed during this tick to the PCA9685. With the motion planner
+		# enabled the joints are first moved towards their targets by at most one tick (dt s).
+		# Once every joint has reached its target the legs are where the gait phase put them,
+		# so its precompiled duty cycles are written instead of looking each joint up again.
+		if self.planner is not None:
+			start = time.perf_counter()
+			targets, tables = self.joint_targets()
+			angles = self.planner.update(targets, dt or 1 / self.control_rate)
+			if self.planner.settled and self.phase_duty is not None:
+				for channel, value in zip(self.leg_channels, self.phase_duty):
+					channel.duty_cycle = value
+				self.head.set_angles()
+			else:
+				for channel, angle, table in zip(self.joint_channels, angles.tolist(), tables):
+					channel.duty_cycle = table.lookup(angle)
+			self.planner_stage.record_since(start)
+		start = time.perf_counter()
+		written = self.frame.commit()
+		self.i2c_stage.record_since(start)
+		return written
@@ -0,0 +1,78 @@
+import threading
+import time
+from array import array
+
+# Usage on a hot path:
+#   stage = PROFILER.stage("control.gait")      # once, at set-up
+#   start = time.perf_counter(); ...; stage.record_since(start)
+
+
+class StageStats:
+	# Ring buffer of the last `size` durations of one stage plus running totals.
+	# Recording is a few float operations, summaries are only computed when asked for.
+	__slots__ = ("samples", "size", "index", "count", "total", "max", "budget", "overruns")
+
+	def __init__(self, size, budget=None):
+		self.samples = array('d', bytes(8 * size))
+		self.size = size
+		self.index = 0
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.budget = budget
+		self.overruns = 0
+
+	def record(self, duration):
+		self.samples[self.index] = duration
+		self.index = (self.index + 1) % self.size
+		self.count += 1
+		self.total += duration
+		if duration > self.max:
+			self.max = duration
+		if self.budget is not None and duration > self.budget:
+			self.overruns += 1
+
+	def record_since(self, start):
+		self.record(time.perf_counter() - start)
+
+	def summary(self):
+		window = sorted(self.samples[:min(self.count, self.size)])
+		if not window:
+			return {"count": 0}
+
+		def percentile(fraction):
+			return window[min(len(window) - 1, int(fraction * len(window)))] * 1000
+
+		return {
+			"count": self.count,
+			"mean_ms": self.total / self.count * 1000,
+			"p50_ms": percentile(0.50),
+			"p99_ms": percentile(0.99),
+			"window_max_ms": window[-1] * 1000,
+			"max_ms": self.max * 1000,
+			"budget_ms": self.budget * 1000 if self.budget is not None else None,
+			"overruns": self.overruns,
+		}
+
+
+class Profiler:
+	def __init__(self, size=1024):
+		self.size = size
+		self.stages = {}
+		self.lock = threading.Lock()
+
+	def stage(self, name, budget=None):
+		# Returns the same StageStats for the same name; budget (seconds) enables overrun counting
+		stats = self.stages.get(name)
+		if stats is None:
+			with self.lock:
+				stats = self.stages.setdefault(name, StageStats(self.size, budget))
+		if budget is not None:
+			stats.budget = budget
+		return stats
+
+	def snapshot(self):
+		return {name: stats.summary() for name, stats in sorted(self.stages.items())}
+
+
+PROFILER = Profiler()
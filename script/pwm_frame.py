@@ -0,0 +1,111 @@
+import struct
+
+# PCA9685 register map: LEDn_ON_L, LEDn_ON_H, LEDn_OFF_L, LEDn_OFF_H for n = 0..15
+LED0_ON_L = 0x06
+CHANNEL_COUNT = 16
+_LED_REGS = struct.Struct("<HH")
+
+
+def duty_to_registers(value):
+	# Same encoding as adafruit_pca9685.PWMChannel.duty_cycle: returns (on, off) counts
+	if not 0 <= value <= 0xFFFF:
+		raise ValueError(f"Out of range: value {value} not 0 <= value <= 65,535")
+	if value == 0xFFFF:
+		return 0x1000, 0
+	if value < 0x0010:
+		return 0, 0x1000
+	return 0, value >> 4
+
+
+class FrameChannel:
+	# Stand-in for a PCA9685 PWMChannel; writes only land in the frame until commit()
+	__slots__ = ("frame", "index")
+
+	def __init__(self, frame, index):
+		self.frame = frame
+		self.index = index
+
+	@property
+	def duty_cycle(self):
+		return self.frame.pending[self.index]
+
+	@duty_cycle.setter
+	def duty_cycle(self, value):
+		if not 0 <= value <= 0xFFFF:
+			raise ValueError(f"Out of range: value {value} not 0 <= value <= 65,535")
+		self.frame.pending[self.index] = value
+
+
+class PwmFrame:
+	# Collects the duty cycles of one control tick and flushes them in a single I2C transaction.
+	# commit() writes one auto-increment block from the first to the last changed channel;
+	# if nothing changed no transaction is made. Relies on MODE1.AI, which PCA9685.frequency sets.
+	def __init__(self, i2c_device):
+		self.i2c_device = i2c_device
+		self.channels = [FrameChannel(self, i) for i in range(CHANNEL_COUNT)]
+		# Channels nobody drives are written once as fully off, matching the power-on state
+		self.pending = [0] * CHANNEL_COUNT
+		self.written = [None] * CHANNEL_COUNT
+		self.buffer = bytearray(1 + 4 * CHANNEL_COUNT)
+		self.transactions = 0
+		self.bytes_written = 0
+
+	def dirty_span(self):
+		first = last = None
+		for i in range(CHANNEL_COUNT):
+			if self.pending[i] != self.written[i]:
+				if first is None:
+					first = i
+				last = i
+		return first, last
+
+	def commit(self):
+		first, last = self.dirty_span()
+		if first is None:
+			return 0
+		self.buffer[0] = LED0_ON_L + 4 * first
+		for i in range(first, last + 1):
+			_LED_REGS.pack_into(self.buffer, 1 + 4 * (i - first), *duty_to_registers(self.pending[i]))
+			self.written[i] = self.pending[i]
+		end = 1 + 4 * (last - first + 1)
+		with self.i2c_device as i2c:
+			i2c.write(self.buffer, end=end)
+		self.transactions += 1
+		self.bytes_written += end
+		return end
+
+
+class FakeI2CDevice:
+	# Minimal adafruit_bus_device.I2CDevice look-alike that counts transactions and bytes
+	# and keeps a register file with PCA9685-style auto-increment.
+	def __init__(self):
+		self.registers = bytearray(256)
+		self.transactions = 0
+		self.bytes_written = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+	def write(self, buf, *, start=0, end=None):
+		data = bytes(buf[start:end])
+		self.transactions += 1
+		self.bytes_written += len(data)
+		register = data[0]
+		self.registers[register:register + len(data) - 1] = data[1:]
+
+	def channel_registers(self, index):
+		return _LED_REGS.unpack_from(self.registers, LED0_ON_L + 4 * index)
+
+
+if __name__ == '__main__':
+	device = FakeI2CDevice()
+	frame = PwmFrame(device)
+	for tick in range(3):
+		for channel in range(12):
+			frame.channels[channel].duty_cycle = 5000 + 16 * (channel + tick % 2)
+		frame.commit()
+		print(f"tick {tick}: {device.transactions} transactions, {device.bytes_written} bytes")
+	print("channel 0 on/off:", device.channel_registers(0))
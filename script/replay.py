@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Off-robot replay of a flight recording (see flight_recorder.py).
+#
+#   python replay.py flight_recorder.bin               timing summary and a check against the recording
+#   python replay.py flight_recorder.bin --repeat 20   replay 20 times and report ticks/sec, as a benchmark
+#
+# The recorded joystick axes and tick lengths are fed through OveralController on the simulated
+# PCA9685, starting from the gait phase, joint angles and duty cycles of the first record, and
+# every following tick is compared with what the robot commanded. Uses the current settings.json,
+# so calibration edits made since the recording show up as mismatches. With the motion planner
+# enabled its velocity state is not recorded; the first ticks can differ until it has settled.
+import argparse
+import time
+
+import numpy as np
+
+import overal_controller
+from control_input import *
+from flight_recorder import read_recording
+
+
+def restore(controller, record):
+	gait = controller.controller
+	gait.phase = record.phase
+	gait.front_left_pos, gait.front_right_pos, gait.rear_left_pos, gait.rear_right_pos = record.positions
+	for i, leg in enumerate(controller.legs):
+		leg.base_angle, leg.hip_angle, leg.knee_angle = record.angles[3 * i:3 * i + 3]
+	controller.head.current_vert, controller.head.current_hor = record.angles[12:14]
+	controller.last_pos_update_time = record.timestamp
+	controller.phase_duty = None
+	if controller.planner is not None:
+		controller.planner.reset(record.angles)
+	controller.frame.pending[:] = record.duties
+	controller.frame.commit()
+
+
+def replay(controller, records):
+	# Runs every record after the first through the control tick; returns per tick
+	# (largest joint angle difference, number of differing duty cycles). Duty cycles are read
+	# back from the simulated chip's registers, so the frame's I2C writes are checked too.
+	angle_errors = np.zeros(len(records))
+	duty_errors = np.zeros(len(records), dtype=np.int64)
+	restore(controller, records[0])
+	for i in range(1, len(records)):
+		record = records[i]
+		js = record.axes
+		if (-js[JOY1_Y] or js[JOY1_X] or js[JOY2_X]):
+			controller.iterate(-js[JOY1_Y], js[JOY1_X], js[JOY2_X], record.dt, record.timestamp)
+		controller.head.move(js[JOY3_X], js[JOY3_Y], record.dt)
+		controller.commit(record.dt)
+		targets, _ = controller.joint_targets()
+		angle_errors[i] = np.max(np.abs(np.subtract(targets, record.angles)))
+		duty_errors[i] = sum(a != b for a, b in zip(controller.pca.duty_cycles(), record.duties))
+	return angle_errors, duty_errors
+
+
+def timing_summary(records, control_rate):
+	dt = np.array([record.dt for record in records])
+	commit = np.array([record.commit_seconds for record in records])
+	period = 1.0 / control_rate
+	late = np.flatnonzero(dt > 1.5 * period)
+	print(f"{len(records)} ticks over {records[-1].timestamp - records[0].timestamp:.1f}s "
+		  f"(ticks {records[0].tick}..{records[-1].tick})")
+	print(f"tick dt     p50 {np.percentile(dt, 50) * 1000:6.2f} ms  p99 {np.percentile(dt, 99) * 1000:6.2f} ms  "
+		  f"max {dt.max() * 1000:6.2f} ms  late {len(late)}")
+	print(f"commit()    p50 {np.percentile(commit, 50) * 1000:6.2f} ms  p99 {np.percentile(commit, 99) * 1000:6.2f} ms  "
+		  f"max {commit.max() * 1000:6.2f} ms")
+	for i in late[np.argsort(dt[late])[::-1][:5]]:
+		print(f"  late tick {records[i].tick}: dt {dt[i] * 1000:.1f} ms, commit {commit[i] * 1000:.1f} ms")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Replay a flight recording on the simulated PCA9685")
+	parser.add_argument("recording", nargs="?", default="flight_recorder.bin")
+	parser.add_argument("--repeat", type=int, default=1, help="replay this many times and report ticks/sec")
+	parser.add_argument("--tolerance", type=float, default=1e-9, help="largest joint angle difference in degrees")
+	args = parser.parse_args()
+
+	records, clock_offset = read_recording(args.recording)
+	if len(records) < 2:
+		print(f"{args.recording} holds {len(records)} records, nothing to replay")
+		return
+	started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(records[0].timestamp + clock_offset))
+	print(f"Recording {args.recording}, first tick at {started}")
+
+	controller = overal_controller.OveralController("sim")
+	timing_summary(records, controller.control_rate)
+
+	start = time.perf_counter()
+	for _ in range(args.repeat):
+		angle_errors, duty_errors = replay(controller, records)
+	elapsed = time.perf_counter() - start
+	ticks = args.repeat * (len(records) - 1)
+	print(f"Replayed {ticks} ticks in {elapsed:.2f}s: {ticks / elapsed:.0f} ticks/sec, "
+		  f"{elapsed / ticks * 1e6:.1f} us per tick")
+
+	mismatched = np.flatnonzero((angle_errors > args.tolerance) | (duty_errors > 0))
+	if not len(mismatched):
+		print("Replay matches the recording")
+		return
+	first = mismatched[0]
+	print(f"{len(mismatched)} ticks differ, first at tick {records[first].tick}: "
+		  f"angles up to {angle_errors[first]:.3g} deg, {duty_errors[first]} duty cycles")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,52 @@
+import time
+
+
+class RateScheduler:
+	# Fixed-rate loop timing on absolute time.monotonic deadlines.
+	# Deadlines advance by exactly one period, so sleep jitter does not accumulate into drift.
+	# A tick that starts after its deadline counts as an overrun; if the loop fell behind by
+	# more than a whole period the missed ticks are dropped instead of being run back to back.
+	def __init__(self, rate_hz):
+		self.period = 1.0 / rate_hz
+		self.next_deadline = None
+		self.last_tick = None
+		self.dt = self.period
+		self.ticks = 0
+		self.overruns = 0
+		self.skipped = 0
+
+	def wait(self):
+		now = time.monotonic()
+		if self.next_deadline is None:
+			self.next_deadline = now
+		remaining = self.next_deadline - now
+		if remaining > 0:
+			time.sleep(remaining)
+			now = time.monotonic()
+		elif remaining < 0:
+			self.overruns += 1
+			missed = int(-remaining / self.period)
+			if missed:
+				self.skipped += missed
+				self.next_deadline += missed * self.period
+		self.dt = now - self.last_tick if self.last_tick is not None else self.period
+		self.last_tick = now
+		self.next_deadline += self.period
+		self.ticks += 1
+		return self.dt
+
+	def stats(self):
+		return {
+			"rate": 1.0 / self.period,
+			"ticks": self.ticks,
+			"overruns": self.overruns,
+			"skipped": self.skipped,
+		}
+
+
+if __name__ == '__main__':
+	scheduler = RateScheduler(50)
+	start = time.monotonic()
+	for i in range(100):
+		scheduler.wait()
+	print(f"100 ticks in {time.monotonic() - start:.3f}s", scheduler.stats())
@@ -1,4 +1,8 @@
 import json
+import logging
+import os
+
+LEG_SECTIONS = ('front_left', 'front_right', 'rear_left', 'rear_right')
 
 def read_settings(settings_file):
 	with open(settings_file, 'r') as f:
@@ -13,6 +17,50 @@ def read_settings(settings_file):
 	return settings, default, front_left, front_right, rear_left, rear_right, general, head
 
 
+class SettingsWatcher:
+	# Re-parses the settings file only when its mtime changes and reports which top-level
+	# sections differ from the previously loaded version
+	def __init__(self, settings_file):
+		self.settings_file = settings_file
+		self.mtime = None
+		self.settings = None
+
+	def poll(self):
+		# Returns {section_name: new_section} for changed sections, {} if nothing changed.
+		# The first successful poll reports every section.
+		try:
+			mtime = os.stat(self.settings_file).st_mtime_ns
+		except OSError as e:
+			logging.warning(f"Cannot stat {self.settings_file}: {e}")
+			return {}
+		if mtime == self.mtime:
+			return {}
+		self.mtime = mtime
+		try:
+			settings = read_settings(self.settings_file)[0]
+		except (OSError, ValueError, KeyError) as e:
+			# Most likely caught mid-save; the next mtime change will retry
+			logging.warning(f"Failed to reload {self.settings_file}: {e}")
+			return {}
+		previous = self.settings or {}
+		self.settings = settings
+		return {name: section for name, section in settings.items() if previous.get(name) != section}
+
+
+def apply_settings_changes(changed, settings, legs, head):
+	# Push changed calibration to the affected objects. legs maps section name to Leg.
+	# Returns the names of the legs that were updated (and the head as 'head').
+	updated = []
+	for name, leg in legs.items():
+		if 'default' in changed or name in changed:
+			leg.reset_angles(settings['default'], settings[name])
+			updated.append(name)
+	if 'head' in changed and head is not None:
+		head.reset_angles(settings['head'])
+		updated.append('head')
+	return updated
+
+
 if __name__ == '__main__':
 	settings_file = 'settings.json'
 	settings = read_settings(settings_file)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Headless kinematic simulation of the real control chain, faster than real time.
+#
+#   python simulator.py                          walk forward at full speed for 2 gait cycles
+#   python simulator.py --right 0.5 --cycles 10  any joystick command, any length
+#   python simulator.py --image gait.png --video gait.mp4 --csv feet.csv
+#
+# Every tick goes through OveralController exactly as on the robot (Controller, gait cache,
+# Leg IK, pulse tables, motion planner) on the simulated PCA9685, with simulated time instead
+# of a clock. The duty cycles the simulated chip's registers end up with (so the PwmFrame
+# encoding and I2C block writes are included) are turned back into joint angles and, with
+# forward kinematics and the settings.json link lengths, into foot positions. IK error is the
+# distance between those feet and the gait targets: it includes unreachable targets, joint limit
+# saturation, PWM resolution and motion planner lag. Out of reach and saturated counts are the
+# controller's own (OveralController.ik_clamped / ik_saturated), as served on /stats.json.
+import argparse
+import math
+import time
+
+import numpy as np
+
+import overal_controller
+from dog import forward_kinematics_batch, pulse_to_angle_array
+from controller import LEG_NAMES
+
+
+def cycle_ticks(controller):
+	# Control ticks per gait cycle
+	gait = controller.controller
+	if controller.realtime_gait:
+		return controller.control_rate / gait.frequency
+	return gait.path_len / max(1, gait.steps)
+
+
+def simulate(controller, forward, right, rotation, cycles):
+	# Runs `cycles` gait cycles of one joystick command; returns per tick the (T, 4, 3) foot
+	# targets and the (T, 12) leg duty cycles held by the PCA9685 after the tick
+	dt = 1.0 / controller.control_rate
+	clock = controller.last_pos_update_time  # simulated time.monotonic() for the "path" gait
+	controller.iterate(forward, right, rotation, dt, clock)  # sets the speeds, so cycle_ticks is known
+	ticks = int(math.ceil(cycles * cycle_ticks(controller)))
+	targets_table = controller.controller.positions_table()
+	targets = np.empty((ticks, 4, 3))
+	duties = np.empty((ticks, 12), dtype=np.int64)
+	leg_registers = [channel.index for channel in controller.leg_channels]
+	for tick in range(ticks):
+		controller.iterate(forward, right, rotation, dt, clock + (tick + 1) * dt)
+		controller.commit(dt)
+		targets[tick] = targets_table[controller.controller.front_left_pos]
+		chip = controller.pca.duty_cycles()
+		duties[tick] = [chip[index] for index in leg_registers]
+	return targets, duties
+
+
+def achieved_feet(legs, duties):
+	feet = np.empty((len(duties), len(legs), 3))
+	for i, leg in enumerate(legs):
+		limits = ((leg.base_min_angle, leg.base_max_angle), (leg.hip_min_angle, leg.hip_max_angle),
+				  (leg.knee_min_angle, leg.knee_max_angle))
+		servo = np.column_stack([pulse_to_angle_array(duties[:, 3 * i + j], *limits[j]) for j in range(3)])
+		feet[:, i] = forward_kinematics_batch(servo, leg.upper_len, leg.thigh_len, leg.shank_len,
+											  leg.private_settings.get("base"), leg.private_settings.get("hip"),
+											  leg.private_settings.get("knee"))
+	return feet
+
+
+def report(controller, targets, feet):
+	error = np.linalg.norm(feet - targets, axis=2)
+	print(f"{'leg':12} {'error mean':>10} {'p99':>8} {'max':>8}   saturated frames (base/hip/knee)   reach")
+	for i, name in enumerate(LEG_NAMES):
+		saturated = controller.ik_saturated[i]
+		unreachable = controller.ik_clamped[i]
+		print(f"{name:12} {error[:, i].mean():10.3f} {np.percentile(error[:, i], 99):8.3f} {error[:, i].max():8.3f}"
+			  f"   {saturated[0]:>9} {saturated[1]:>6} {saturated[2]:>6}"
+			  f"{'':15}{'ok' if not unreachable else f'{unreachable} frames out of reach'}")
+	for i, name in enumerate(LEG_NAMES):
+		low, high = targets[:, i].min(axis=0), targets[:, i].max(axis=0)
+		print(f"{name:12} foot x {low[0]:7.1f}..{high[0]:6.1f}  y {low[1]:7.1f}..{high[1]:6.1f}  z {low[2]:7.1f}..{high[2]:6.1f}")
+	return error
+
+
+def write_csv(path, targets, feet, error):
+	columns = []
+	header = ["tick"]
+	for i, name in enumerate(LEG_NAMES):
+		columns += [targets[:, i], feet[:, i], error[:, i:i + 1]]
+		header += [f"{name}_target_{axis}" for axis in "xyz"] + [f"{name}_foot_{axis}" for axis in "xyz"] + [f"{name}_error"]
+	table = np.column_stack([np.arange(len(targets))] + columns)
+	np.savetxt(path, table, delimiter=",", header=",".join(header), comments="", fmt="%.4f")
+
+
+class Canvas:
+	# Side (y/z) and top (y/x) views of the four feet, drawn with OpenCV
+	COLOURS = ((0, 0, 255), (0, 160, 0), (255, 0, 0), (0, 160, 255))
+
+	def __init__(self, targets, feet, size=400):
+		import cv2
+		self.cv2 = cv2
+		self.size = size
+		points = np.concatenate([targets.reshape(-1, 3), feet.reshape(-1, 3)])
+		self.low = points.min(axis=0) - 5
+		self.scale = (size - 20) / max(1e-6, (points.max(axis=0) + 5 - self.low).max())
+
+	def pixel(self, view, point):
+		horizontal, vertical = (1, 2) if view == 0 else (1, 0)
+		x = 10 + (point[horizontal] - self.low[horizontal]) * self.scale + view * self.size
+		y = self.size - 10 - (point[vertical] - self.low[vertical]) * self.scale
+		return int(x), int(y)
+
+	def blank(self):
+		image = np.full((self.size, 2 * self.size, 3), 255, dtype=np.uint8)
+		self.cv2.line(image, (self.size, 0), (self.size, self.size), (200, 200, 200), 1)
+		self.cv2.putText(image, "side: y / z", (10, 20), self.cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+		self.cv2.putText(image, "top: y / x", (self.size + 10, 20), self.cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+		return image
+
+	def trajectories(self, targets, feet):
+		image = self.blank()
+		for view in (0, 1):
+			for leg, colour in enumerate(self.COLOURS):
+				target = np.array([self.pixel(view, p) for p in targets[:, leg]], dtype=np.int32)
+				foot = np.array([self.pixel(view, p) for p in feet[:, leg]], dtype=np.int32)
+				self.cv2.polylines(image, [target], False, (180, 180, 180), 1)
+				self.cv2.polylines(image, [foot], False, colour, 1)
+		return image
+
+	def frame(self, image, targets, feet, tick):
+		image = image.copy()
+		for view in (0, 1):
+			for leg, colour in enumerate(self.COLOURS):
+				self.cv2.circle(image, self.pixel(view, targets[tick, leg]), 4, (120, 120, 120), 1)
+				self.cv2.circle(image, self.pixel(view, feet[tick, leg]), 3, colour, -1)
+		self.cv2.putText(image, f"tick {tick}", (10, self.size - 10), self.cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+		return image
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Headless gait and IK simulation with settings.json")
+	parser.add_argument("--forward", type=float, default=1.0, help="joystick forward axis, -1..1")
+	parser.add_argument("--right", type=float, default=0.0, help="joystick sideways axis, -1..1")
+	parser.add_argument("--rotation", type=float, default=0.0, help="joystick rotation axis, -1..1")
+	parser.add_argument("--cycles", type=float, default=2.0, help="gait cycles to simulate")
+	parser.add_argument("--csv", help="write per tick targets, feet and error to this file")
+	parser.add_argument("--image", help="write foot trajectories to this image (needs OpenCV)")
+	parser.add_argument("--video", help="write an animation to this .mp4 or .avi (needs OpenCV)")
+	args = parser.parse_args()
+
+	controller = overal_controller.OveralController("sim")
+	start = time.perf_counter()
+	targets, duties = simulate(controller, args.forward, args.right, args.rotation, args.cycles)
+	elapsed = time.perf_counter() - start
+	feet = achieved_feet(controller.legs, duties)
+	ticks = len(targets)
+	print(f"{ticks} ticks ({ticks / controller.control_rate:.1f}s of robot time) in {elapsed:.3f}s, "
+		  f"{ticks / elapsed:.0f} ticks/sec, {'spline' if controller.realtime_gait else 'path'} gait")
+	error = report(controller, targets, feet)
+
+	if args.csv:
+		write_csv(args.csv, targets, feet, error)
+	if args.image or args.video:
+		canvas = Canvas(targets, feet)
+		background = canvas.trajectories(targets, feet)
+		if args.image:
+			canvas.cv2.imwrite(args.image, background)
+		if args.video:
+			fourcc = canvas.cv2.VideoWriter_fourcc(*("mp4v" if args.video.endswith(".mp4") else "MJPG"))
+			writer = canvas.cv2.VideoWriter(args.video, fourcc, controller.control_rate, background.shape[1::-1])
+			for tick in range(ticks):
+				writer.write(canvas.frame(background, targets, feet, tick))
+			writer.release()
+
+
+if __name__ == "__main__":
+	main()
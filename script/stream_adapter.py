@@ -0,0 +1,133 @@
+import logging
+import threading
+
+from scheduler import RateScheduler
+
+
+class StreamAdapter(threading.Thread):
+	# Degrades the MJPEG stream before it can hurt gait timing or swamp the Wi-Fi, and restores
+	# it once there is headroom again. Every `interval` seconds it looks at:
+	#   - the control loop: more than max_late_ratio of the interval's ticks overrunning or
+	#     skipped, or a p99 tick longer than max_tick_load of the period, mean the camera is
+	#     taking CPU time the gait needs (a single late tick, e.g. at startup, is not enough)
+	#   - every stream client: the share of frames it had to skip (MJPEGBroadcaster drops
+	#     frames for clients that are still sending the previous one) above max_drop_ratio
+	# Control pressure lowers the frame rate first, then the resolution, then the quality;
+	# client pressure lowers the quality first, then the frame rate, then the resolution.
+	# After recover_intervals quiet intervals in a row the most recent change is undone.
+	# camera is a camera source with set_quality, set_frame_rate and set_resolution.
+	def __init__(self, camera, broadcaster, control_stats, settings):
+		super().__init__(daemon=True)
+		self.camera = camera
+		self.broadcaster = broadcaster
+		self.control_stats = control_stats
+		self.min_quality, self.max_quality = settings.get("quality", [40, 85])
+		self.quality_step = settings.get("quality_step", 10)
+		self.min_fps, self.max_fps = settings.get("fps", [8, 30])
+		self.resolutions = [tuple(size) for size in settings.get("resolutions", [[640, 480], [320, 240]])]
+		self.max_drop_ratio = settings.get("max_drop_ratio", 0.25)
+		self.max_tick_load = settings.get("max_tick_load", 0.5)
+		self.max_late_ratio = settings.get("max_late_ratio", 0.05)
+		self.recover_intervals = settings.get("recover_intervals", 5)
+		self.scheduler = RateScheduler(1.0 / settings.get("interval", 1.0))
+		self.quality = self.max_quality
+		self.fps = self.max_fps
+		self.resolution = 0  # index into resolutions
+		self.changes = []  # (knob, previous value), undone last in first out
+		self.quiet = 0
+		self.last_control = None
+		self.last_clients = {}
+		self.client_rates = []
+		self.running = True
+
+	def run(self):
+		self.apply()
+		while self.running:
+			self.scheduler.wait()
+			try:
+				self.update()
+			except Exception as e:
+				logging.warning(f"Stream adaptation failed: {e}")
+
+	def stop(self):
+		self.running = False
+
+	def control_pressure(self):
+		control = self.control_stats()
+		last, self.last_control = self.last_control, control
+		if last is None:
+			return False
+		late = control["overruns"] - last["overruns"] + control["skipped"] - last["skipped"]
+		ticks = max(1, control["ticks"] - last["ticks"])
+		period_ms = 1000.0 / control.get("rate", 50)
+		return late > self.max_late_ratio * ticks or control["tick_p99_ms"] > self.max_tick_load * period_ms
+
+	def client_pressure(self):
+		clients = {}
+		rates = []
+		pressure = False
+		for key, sent, dropped, sent_bytes in self.broadcaster.client_counters():
+			clients[key] = (sent, dropped, sent_bytes)
+			last = self.last_clients.get(key)
+			if last is None:
+				continue
+			frames = sent - last[0] + dropped - last[1]
+			rates.append((sent_bytes - last[2]) / self.scheduler.dt)
+			if frames and (dropped - last[1]) / frames > self.max_drop_ratio:
+				pressure = True
+		self.last_clients = clients
+		self.client_rates = rates
+		return pressure
+
+	def update(self):
+		control = self.control_pressure()
+		clients = self.client_pressure()
+		if control:
+			changed = self.degrade(("fps", "resolution", "quality"))
+		elif clients:
+			changed = self.degrade(("quality", "fps", "resolution"))
+		else:
+			self.quiet += 1
+			changed = self.quiet >= self.recover_intervals and self.recover()
+		if changed:
+			self.quiet = 0
+			self.apply()
+			print(f"[Stream] quality {self.quality}, {self.fps} fps, {self.resolutions[self.resolution]} "
+				  f"({'control overrun' if control else 'slow client' if clients else 'recovered'})")
+
+	def degrade(self, order):
+		self.quiet = 0
+		for knob in order:
+			if knob == "quality" and self.quality > self.min_quality:
+				self.changes.append((knob, self.quality))
+				self.quality = max(self.min_quality, self.quality - self.quality_step)
+				return True
+			if knob == "fps" and self.fps > self.min_fps:
+				self.changes.append((knob, self.fps))
+				self.fps = max(self.min_fps, round(self.fps * 2 / 3))
+				return True
+			if knob == "resolution" and self.resolution < len(self.resolutions) - 1:
+				self.changes.append((knob, self.resolution))
+				self.resolution += 1
+				return True
+		return False
+
+	def recover(self):
+		if not self.changes:
+			return False
+		knob, value = self.changes.pop()
+		setattr(self, knob, value)
+		return True
+
+	def apply(self):
+		self.camera.set_quality(self.quality)
+		self.camera.set_frame_rate(self.fps)
+		self.camera.set_resolution(self.resolutions[self.resolution])
+
+	def stats(self):
+		return {
+			"quality": self.quality,
+			"fps": self.fps,
+			"resolution": self.resolutions[self.resolution],
+			"client_bytes_per_sec": self.client_rates,
+		}
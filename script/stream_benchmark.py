@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Measures what a viewer gets from the running robot: frame rate, bitrate, latency and CPU use.
+#
+#   python stream_benchmark.py                                  whichever stream main.py is configured for
+#   python stream_benchmark.py --seconds 30 --pid $(pgrep -f main.py)
+#
+# Switch camera.stream between "mjpeg" and "h264" in settings.json and run it once per mode to
+# compare them. CPU numbers are only meaningful on the Pi itself (--host localhost). Latency is
+# the time from the robot stamping a frame to it arriving here, so from another machine it needs
+# synchronised clocks; browser decode and display time are not included.
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from h264_broadcast import STAMP, VIDEO_PATH, is_keyframe
+from mjpeg_broadcast import STREAM_PATH
+
+HTTP_STREAM_PORT = 8001
+WS_PORT = 8765
+
+
+def system_cpu():
+	# (busy, total) jiffies of all CPUs since boot
+	with open("/proc/stat") as f:
+		values = [int(v) for v in f.readline().split()[1:]]
+	idle = values[3] + values[4]
+	return sum(values) - idle, sum(values)
+
+
+def process_cpu(pid):
+	# user + system CPU seconds of `pid`
+	with open(f"/proc/{pid}/stat") as f:
+		fields = f.read().rsplit(")", 1)[1].split()
+	return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def stream_mode(host):
+	import websockets
+	async with websockets.connect(f"ws://{host}:{WS_PORT}") as ws:
+		message = json.loads(await asyncio.wait_for(ws.recv(), 5))
+	return message.get("stream", "mjpeg")
+
+
+async def measure_mjpeg(host, seconds):
+	# (arrival time, bytes, capture timestamp, keyframe) of every frame received
+	frames = []
+	reader, writer = await asyncio.open_connection(host, HTTP_STREAM_PORT)
+	writer.write(f"GET {STREAM_PATH} HTTP/1.0\r\n\r\n".encode())
+	while (await reader.readline()) not in (b"\r\n", b""):
+		pass
+	end = time.time() + seconds
+	try:
+		while time.time() < end:
+			headers = {}
+			while True:
+				line = await reader.readline()
+				if line == b"":
+					return frames
+				if line == b"\r\n" and headers:
+					break
+				if b":" in line:
+					name, value = line.decode("latin-1").split(":", 1)
+					headers[name.strip().lower()] = value.strip()
+			length = int(headers["content-length"])
+			await reader.readexactly(length + 2)
+			frames.append((time.time(), length, float(headers.get("x-timestamp", "nan")), True))
+	finally:
+		writer.close()
+	return frames
+
+
+async def measure_h264(host, seconds):
+	import websockets
+	frames = []
+	async with websockets.connect(f"ws://{host}:{WS_PORT}{VIDEO_PATH}", max_size=None) as ws:
+		end = time.time() + seconds
+		while time.time() < end:
+			try:
+				message = await asyncio.wait_for(ws.recv(), max(0.01, end - time.time()))
+			except asyncio.TimeoutError:
+				break
+			frame = message[STAMP.size:]
+			frames.append((time.time(), len(frame), STAMP.unpack_from(message)[0], is_keyframe(frame)))
+	return frames
+
+
+def summarise(mode, frames, seconds, cpu, process):
+	if not frames:
+		return {"mode": mode, "frames": 0}
+	arrival = np.array([frame[0] for frame in frames])
+	sizes = np.array([frame[1] for frame in frames])
+	latency = (arrival - np.array([frame[2] for frame in frames])) * 1000
+	result = {
+		"mode": mode,
+		"frames": len(frames),
+		"fps": len(frames) / seconds,
+		"kbit_per_sec": float(sizes.sum()) * 8 / seconds / 1000,
+		"mean_frame_bytes": float(sizes.mean()),
+		"keyframes": sum(frame[3] for frame in frames),
+		"latency_p50_ms": float(np.nanpercentile(latency, 50)),
+		"latency_p99_ms": float(np.nanpercentile(latency, 99)),
+		"system_cpu_percent": cpu,
+	}
+	if process is not None:
+		result["process_cpu_percent"] = process
+	return result
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Measure the robot's video stream")
+	parser.add_argument("--host", default="localhost")
+	parser.add_argument("--seconds", type=float, default=10.0)
+	parser.add_argument("--mode", choices=("auto", "mjpeg", "h264"), default="auto")
+	parser.add_argument("--pid", type=int, help="main.py process for per-process CPU use")
+	parser.add_argument("--json", action="store_true", help="print the result as JSON")
+	args = parser.parse_args()
+
+	mode = asyncio.run(stream_mode(args.host)) if args.mode == "auto" else args.mode
+	measure = measure_h264 if mode == "h264" else measure_mjpeg
+	busy, total = system_cpu()
+	process = process_cpu(args.pid) if args.pid else None
+	start = time.time()
+	frames = asyncio.run(measure(args.host, args.seconds))
+	elapsed = time.time() - start
+	busy_end, total_end = system_cpu()
+	cpu = 100.0 * (busy_end - busy) / max(1, total_end - total)
+	if process is not None:
+		process = 100.0 * (process_cpu(args.pid) - process) / elapsed
+
+	result = summarise(mode, frames, elapsed, cpu, process)
+	if args.json:
+		print(json.dumps(result, indent=2))
+		return
+	for name, value in result.items():
+		print(f"{name:22} {value:.1f}" if isinstance(value, float) else f"{name:22} {value}")
+
+
+if __name__ == "__main__":
+	main()
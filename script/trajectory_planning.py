@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 def interpolate_3d(start, end, step):
 	dx = end[0] - start[0]
 	dy = end[1] - start[1]
@@ -43,3 +45,43 @@ def interpolate_path(points, step):
 		full_path.extend(segment)
 
 	return full_path
+
+
+class GaitTrajectory:
+	# Time-parameterised foot cycle in the same normalised units as interpolate_path:
+	# columns are (lx, ly, lz) with lx == ly running from 1 to -1 on the ground (lz == -1)
+	# and lz == 0 at the top of the swing. Phase 0 is the middle of the swing, like the
+	# first reference point of Controller's path.
+	#   stance: the foot moves back at constant speed for duty_factor of the cycle
+	#   swing: cubic Hermite from -1 to 1 whose end tangents match the stance speed, with a
+	#          16 s^2 (1 - s)^2 lift profile so the foot leaves and lands with zero vertical speed
+	def __init__(self, duty_factor=0.7):
+		self.duty_factor = duty_factor
+
+	def sample(self, phase):
+		# phase: scalar or array of cycle fractions (any real values, wrapped to [0, 1))
+		phase = np.asarray(phase, dtype=np.float64)
+		swing_fraction = 1.0 - self.duty_factor
+		v = np.mod(phase + swing_fraction / 2, 1.0)
+		swinging = v < swing_fraction
+
+		s = np.where(swinging, v / swing_fraction, 0.0)
+		tangent = -2.0 * swing_fraction / self.duty_factor
+		s2 = s * s
+		s3 = s2 * s
+		swing_x = (-(2 * s3 - 3 * s2 + 1) + (s3 - 2 * s2 + s) * tangent
+				   + (-2 * s3 + 3 * s2) + (s3 - s2) * tangent)
+		swing_z = -1.0 + 16.0 * s2 * (1.0 - s) ** 2
+
+		t = (v - swing_fraction) / self.duty_factor
+		stance_x = 1.0 - 2.0 * t
+
+		points = np.empty(phase.shape + (3,))
+		points[..., 0] = np.where(swinging, swing_x, stance_x)
+		points[..., 1] = points[..., 0]
+		points[..., 2] = np.where(swinging, swing_z, -1.0)
+		return points
+
+	def cycle(self, points):
+		# The whole cycle sampled at `points` equally spaced instants, shape (points, 3)
+		return self.sample(np.arange(points) / points)